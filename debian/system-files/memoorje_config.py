@@ -1,6 +1,7 @@
 # Copy this file to /etc/memoorje and adapt it to your needs
 
 import logging
+from pathlib import Path
 
 from memoorje.settings import *
 
@@ -26,6 +27,8 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = "user"
 EMAIL_HOST_PASSWORD = "password"
 EMAIL_USE_TLS = True
+# queue emails in the database and send them with the flushmailqueue cron job
+EMAIL_QUEUE_ENABLED = True
 
 # database settings
 DATABASES = {
@@ -38,9 +41,24 @@ DATABASES = {
     }
 }
 
+# A cache shared by all processes, e.g. for checked recipient tokens. The cache table is created when the service starts.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "memoorje_cache",
+    }
+}
+
 # django file handling
 MEDIA_ROOT = "/var/lib/memoorje/media"
 STATIC_ROOT = "/var/lib/memoorje/static"
+# Upgrade note: Without this setting, capsule data was stored in the default MEDIA_ROOT below the memoorje package
+# (/usr/lib/python3/dist-packages/media/data). Move the existing files before adopting it, e.g. with
+#   mv /usr/lib/python3/dist-packages/media/data /var/lib/memoorje/media/
+# The files need to stay in this directory, as nginx serves them from there (see CAPSULE_DATA_DOWNLOAD_OFFLOAD).
+CAPSULE_DATA_DIR = Path(MEDIA_ROOT) / "data"
+# let nginx send capsule data (see the internal location in /etc/nginx/snippets/memoorje.conf)
+CAPSULE_DATA_DOWNLOAD_OFFLOAD = "x-accel-redirect"
 
 # security
 SECRET_KEY = None
@@ -1,32 +1,53 @@
+from datetime import datetime
+
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Q
 from django.utils.timezone import now
 
 from memoorje.accounting.models import Transaction
 from memoorje.models import Capsule
 
 
+def count_elapsed_months(start: datetime, end: datetime) -> int:
+    """The number of full months elapsed between start and end (i.e. the largest n with start + n months <= end)."""
+    difference = relativedelta(end, start)
+    months = max(difference.years * 12 + difference.months, 0)
+    # adding months isn't reversible at the end of months (e.g. Jan 31st + 1 month = Feb 28th)
+    while start + relativedelta(months=months + 1) <= end:
+        months += 1
+    while months > 0 and start + relativedelta(months=months) > end:
+        months -= 1
+    return months
+
+
 class Command(BaseCommand):
     help = "Charge monthly dues from users' accounts"
 
     def handle(self, *args, **options):
-        def has_dues_paid_after(c, t):
-            return (
-                c.transactions.filter(type=Transaction.Type.MONTHLY_DUE)
-                .order_by("created_on")
-                .exclude(created_on__lt=t)
-                .exists()
+        charged_on = now()
+        # A due is charged for each month elapsed since the creation of a capsule. All dues of months which were elapsed
+        # when the latest due was charged are considered paid.
+        capsules = Capsule.objects.annotate(
+            last_due_charged_on=Max(
+                "transactions__created_on", filter=Q(transactions__type=Transaction.Type.MONTHLY_DUE)
             )
-
-        def charge_due(c):
-            c.transactions.create(
-                account_holder=c.owner, type=Transaction.Type.MONTHLY_DUE, amount=-settings.MONTHLY_DUE_PER_CAPSULE
+        ).only("id", "owner_id", "created_on")
+        dues = []
+        for capsule in capsules.iterator():
+            due_count = count_elapsed_months(capsule.created_on, charged_on)
+            if capsule.last_due_charged_on is not None:
+                due_count -= count_elapsed_months(capsule.created_on, capsule.last_due_charged_on)
+            dues.extend(
+                Transaction(
+                    account_holder_id=capsule.owner_id,
+                    capsule=capsule,
+                    type=Transaction.Type.MONTHLY_DUE,
+                    amount=-settings.MONTHLY_DUE_PER_CAPSULE,
+                )
+                for _ in range(due_count)
             )
-
-        for capsule in Capsule.objects.all():
-            due_time = capsule.created_on + relativedelta(months=1)
-            while due_time <= now():
-                if not has_dues_paid_after(capsule, due_time):
-                    charge_due(capsule)
-                due_time += relativedelta(months=1)
+        with transaction.atomic():
+            Transaction.objects.bulk_create(dues)
@@ -0,0 +1,44 @@
+import logging
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from memoorje.accounting.models import AccountBalance, Transaction
+from memoorje.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Verifies the account balances against the sum of all transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Correct account balances which differ from the sum")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # The balances are locked before the transactions are summed up, so transactions saved meanwhile wait for the
+            # lock and are neither summed up nor counted in the balances.
+            balances = dict(AccountBalance.objects.select_for_update().values_list("account_holder", "amount"))
+            transaction_sums = dict(
+                Transaction.objects.order_by()
+                .values("account_holder")
+                .annotate(amount_sum=Sum("amount"))
+                .values_list("account_holder", "amount_sum")
+            )
+            differences = {}
+            for account_holder_id in User.objects.values_list("pk", flat=True):
+                expected = transaction_sums.get(account_holder_id, 0)
+                if balances.get(account_holder_id) != expected:
+                    logger.warning(
+                        f"Account balance of user {account_holder_id} is {balances.get(account_holder_id)} "
+                        f"but the sum of transactions is {expected}"
+                    )
+                    differences[account_holder_id] = expected - balances.get(account_holder_id, 0)
+            if options["fix"]:
+                AccountBalance.objects.add(differences)
+        if differences:
+            self.stdout.write(f"{len(differences)} account balances differ from the sum of transactions.")
+            if options["fix"]:
+                self.stdout.write("They have been corrected.")
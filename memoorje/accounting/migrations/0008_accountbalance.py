@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:31
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+import memoorje.accounting.models
+
+
+def create_account_balances(apps, schema_editor):
+    AccountBalance = apps.get_model("accounting", "AccountBalance")
+    Transaction = apps.get_model("accounting", "Transaction")
+    User = apps.get_model("memoorje", "User")
+    amounts = dict(
+        Transaction.objects.order_by()
+        .values("account_holder")
+        .annotate(amount_sum=Sum("amount"))
+        .values_list("account_holder", "amount_sum")
+    )
+    AccountBalance.objects.bulk_create(
+        [AccountBalance(account_holder_id=pk, amount=amounts.get(pk, 0)) for pk in User.objects.values_list("pk", flat=True)]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memoorje', '0041_journalentry_user_created_on_index'),
+        ('accounting', '0007_auto_20220216_1203'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('account_holder', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='account_balance', serialize=False, to='memoorje.user')),
+                ('amount', memoorje.accounting.models.CurrencyField(decimal_places=2, default=0, max_digits=8)),
+            ],
+        ),
+        migrations.RunPython(create_account_balances, migrations.RunPython.noop),
+    ]
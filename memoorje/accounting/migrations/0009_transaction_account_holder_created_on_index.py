@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0008_accountbalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account_holder', 'created_on', 'id'], name='accounting__account_56f0e3_idx'),
+        ),
+    ]
@@ -1,9 +1,12 @@
+from collections import defaultdict
 from decimal import Decimal
+from typing import Dict, Mapping, Optional
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db import models
-from django.db.models import Sum
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Case, F, Func, Subquery, Sum, Value, When
 from django.utils.timezone import now
 
 
@@ -22,10 +25,57 @@ class ExpenseType(models.Model):
 
 class ExpenseQuerySet(models.QuerySet):
     def get_amount_sum(self):
-        reference_period = relativedelta(months=settings.EXPENSE_TYPE_AMOUNT_SUM_REFERENCE_PERIOD_MONTHS)
-        amount_sum = self.filter(created_on__gt=now() - reference_period).aggregate(Sum("amount"))
+        amount_sum = self.filter(created_on__gt=_get_expense_reference_start()).aggregate(Sum("amount"))
         return amount_sum["amount__sum"] or Decimal(0)
 
+    def get_amount_sums_per_capsule(self) -> Dict[Optional[int], Decimal]:
+        """
+        The sum of amounts in the reference period divided by the number of capsules for each expense type id (None for
+        expenses without type). Expense types without expenses are missing.
+        """
+        from memoorje.models import Capsule
+
+        rows = (
+            self.filter(created_on__gt=_get_expense_reference_start())
+            .order_by()
+            .values("type")
+            .annotate(
+                amount_sum=Sum("amount"),
+                # counting the capsules in a subquery saves a query
+                capsule_count=Subquery(
+                    Capsule.objects.order_by().values(count=Func("pk", function="COUNT")),
+                    output_field=models.IntegerField(),
+                ),
+            )
+        )
+        return {row["type"]: row["amount_sum"] / max(row["capsule_count"], 1) for row in rows}
+
+
+EXPENSE_AMOUNT_SUMS_CACHE_KEY = "memoorje.accounting.expense_amount_sums_per_capsule"
+
+
+def _get_expense_reference_start():
+    return now() - relativedelta(months=settings.EXPENSE_TYPE_AMOUNT_SUM_REFERENCE_PERIOD_MONTHS)
+
+
+def get_expense_amount_sums_per_capsule() -> Dict[Optional[int], Decimal]:
+    """Cached Expense.objects.get_amount_sums_per_capsule() (see refresh_expense_amount_sums_per_capsule())."""
+    amount_sums = cache.get(EXPENSE_AMOUNT_SUMS_CACHE_KEY)
+    if amount_sums is None:
+        amount_sums = refresh_expense_amount_sums_per_capsule()
+    return amount_sums
+
+
+def refresh_expense_amount_sums_per_capsule() -> Dict[Optional[int], Decimal]:
+    """
+    Update the cached amount sums per capsule. They expire after a while, as the reference period moves on and the number
+    of capsules changes. Other processes only see the update if the cache is shared (see
+    EXPENSE_TYPE_AMOUNT_SUM_CACHE_SECONDS).
+    """
+    amount_sums = Expense.objects.get_amount_sums_per_capsule()
+    cache.set(EXPENSE_AMOUNT_SUMS_CACHE_KEY, amount_sums, settings.EXPENSE_TYPE_AMOUNT_SUM_CACHE_SECONDS)
+    return amount_sums
+
 
 class Expense(models.Model):
     created_on = models.DateTimeField(auto_now_add=True)
@@ -37,9 +87,62 @@ class Expense(models.Model):
     objects = models.Manager.from_queryset(ExpenseQuerySet)()
 
 
-class TransactionManager(models.Manager):
+class AccountBalanceManager(models.Manager):
+    def add(self, amounts: Mapping[int, Decimal]):
+        """Add the given amounts to the balances of the account holders with the given ids."""
+        amounts = {account_holder_id: amount for account_holder_id, amount in amounts.items() if amount}
+        if len(amounts) == 0:
+            return
+        batch_size = settings.ACCOUNT_BALANCE_UPDATE_BATCH_SIZE
+        # the balances are always updated in the same order, so concurrent updates don't deadlock
+        account_holder_ids = sorted(amounts)
+        with transaction.atomic():
+            self.bulk_create(
+                [AccountBalance(account_holder_id=account_holder_id) for account_holder_id in account_holder_ids],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            for start in range(0, len(account_holder_ids), batch_size):
+                batch = account_holder_ids[start : start + batch_size]
+                self.filter(account_holder_id__in=batch).update(
+                    amount=F("amount")
+                    + Case(
+                        *(When(account_holder_id=pk, then=Value(amounts[pk])) for pk in batch),
+                        output_field=CurrencyField(),
+                    )
+                )
+
+
+class AccountBalance(models.Model):
+    """The sum of all transactions of an account holder. It is updated whenever a transaction is saved or deleted."""
+
+    account_holder = models.OneToOneField(
+        "memoorje.User", on_delete=models.CASCADE, primary_key=True, related_name="account_balance"
+    )
+    amount = CurrencyField(default=0)
+
+    objects = AccountBalanceManager()
+
+
+class TransactionQuerySet(models.QuerySet):
+    """
+    The account balances are updated when transactions are saved, bulk created or deleted (see
+    signals.subtract_deleted_transaction). update() bypasses them, so use save() for changing amounts or account holders
+    (or run reconcilebalances --fix afterwards).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            amounts = defaultdict(Decimal)
+            for obj in objs:
+                amounts[obj.account_holder_id] += obj.amount
+            AccountBalance.objects.add(amounts)
+        return objs
+
     def get_balance(self):
-        return self.get_queryset().aggregate(Sum("amount"))["amount__sum"] or Decimal(0)
+        """The sum of all transactions (use AccountBalance for the balance of a single account holder)."""
+        return self.aggregate(Sum("amount"))["amount__sum"] or Decimal(0)
 
 
 class Transaction(models.Model):
@@ -67,4 +170,19 @@ class Transaction(models.Model):
     # the actual amount (positive = incoming)
     amount = CurrencyField()
 
-    objects = TransactionManager()
+    objects = models.Manager.from_queryset(TransactionQuerySet)()
+
+    class Meta:
+        indexes = [models.Index(fields=["account_holder", "created_on", "id"])]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            amounts = defaultdict(Decimal)
+            if self.pk is not None:
+                # transactions might be changed in the admin
+                previous = Transaction.objects.filter(pk=self.pk).values("account_holder_id", "amount").first()
+                if previous is not None:
+                    amounts[previous["account_holder_id"]] -= previous["amount"]
+            super().save(*args, **kwargs)
+            amounts[self.account_holder_id] += Decimal(self.amount)
+            AccountBalance.objects.add(amounts)
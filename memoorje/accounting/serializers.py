@@ -1,8 +1,9 @@
+from decimal import Decimal
+
 from django.conf import settings
 from rest_framework import serializers
 
-from memoorje.accounting.models import Expense, ExpenseType, Transaction
-from memoorje.models import Capsule
+from memoorje.accounting.models import ExpenseType, get_expense_amount_sums_per_capsule, Transaction
 
 
 class ExpenseTypeListSerializer(serializers.ListSerializer):
@@ -21,17 +22,9 @@ class ExpenseTypeSerializer(serializers.HyperlinkedModelSerializer):
         list_serializer_class = ExpenseTypeListSerializer
 
     def get_amount_sum_per_capsule(self, obj):
-        amount_sum = self._get_expense_query_set(obj).get_amount_sum()
-        capsule_count = Capsule.objects.count()
-        # FIXME: this will fail if there are no capsules
-        result = amount_sum / capsule_count
+        result = get_expense_amount_sums_per_capsule().get(obj.pk, Decimal(0))
         return serializers.DecimalField(**settings.CURRENCY_REPRESENTATION).to_representation(result)
 
-    def _get_expense_query_set(self, expense_type: ExpenseType):
-        if expense_type.name is None:
-            return Expense.objects.filter(type__isnull=True)
-        return expense_type.expenses
-
 
 class TransactionSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
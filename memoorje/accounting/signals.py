@@ -0,0 +1,34 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from memoorje.accounting.models import (
+    AccountBalance,
+    Expense,
+    ExpenseType,
+    refresh_expense_amount_sums_per_capsule,
+    Transaction,
+)
+from memoorje.models import User
+
+
+@receiver(post_save, sender=User)
+def create_account_balance(instance: User, created: bool, **kwargs):
+    if created:
+        AccountBalance.objects.get_or_create(account_holder=instance)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=ExpenseType)
+def refresh_expense_summary(**kwargs):
+    refresh_expense_amount_sums_per_capsule()
+
+
+@receiver(post_delete, sender=Transaction)
+def subtract_deleted_transaction(instance: Transaction, **kwargs):
+    # Sent for each transaction, even when deleting a queryset (e.g. in the admin). If the account holder is deleted
+    # along with the transaction, the balance is gone already.
+    AccountBalance.objects.filter(account_holder_id=instance.account_holder_id).update(
+        amount=F("amount") - instance.amount
+    )
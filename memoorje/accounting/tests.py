@@ -1,17 +1,36 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from decimal import Decimal
+from io import StringIO
 import json
 
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.core import management
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
 from rest_framework import status
 
-from memoorje.accounting.models import Expense, ExpenseType, Transaction
+from memoorje.accounting.management.commands.chargedues import count_elapsed_months
+from memoorje.accounting.models import (
+    AccountBalance,
+    Expense,
+    ExpenseType,
+    get_expense_amount_sums_per_capsule,
+    Transaction,
+)
+from memoorje.models import Capsule
 from memoorje.rest_api.tests.utils import format_decimal, format_time
 from memoorje.tests.mixins import CapsuleMixin
 
 
 class AccountingTestCase(CapsuleMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
     def test_charge_dues(self):
         self.create_capsule()
         self.capsule.created_on -= timedelta(days=40)
@@ -19,6 +38,39 @@ class AccountingTestCase(CapsuleMixin, TestCase):
         management.call_command("chargedues")
         self.assertEqual(Transaction.objects.count(), 1)
 
+    def test_charge_dues_for_all_elapsed_months(self):
+        self.create_capsule()
+        Capsule.objects.update(created_on=now() - relativedelta(months=3, days=1))
+        management.call_command("chargedues")
+        self.assertEqual(Transaction.objects.count(), 3)
+        management.call_command("chargedues")
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_charge_dues_only_for_months_elapsed_after_last_due(self):
+        self.create_capsule()
+        Capsule.objects.update(created_on=now() - relativedelta(months=3, days=1))
+        self.capsule.transactions.create(
+            account_holder=self.user, type=Transaction.Type.MONTHLY_DUE, amount=-settings.MONTHLY_DUE_PER_CAPSULE
+        )
+        Transaction.objects.update(created_on=now() - relativedelta(days=15))
+        management.call_command("chargedues")
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_charge_dues_queries_do_not_depend_on_capsule_count(self):
+        for _ in range(3):
+            self.create_capsule()
+        Capsule.objects.update(created_on=now() - relativedelta(months=2, days=1))
+        # select capsules, insert dues and update the account balances (within savepoints)
+        with self.assertNumQueries(10):
+            management.call_command("chargedues")
+        self.assertEqual(Transaction.objects.count(), 6)
+
+    def test_count_elapsed_months(self):
+        self.assertEqual(count_elapsed_months(datetime(2022, 1, 31), datetime(2022, 2, 27)), 0)
+        self.assertEqual(count_elapsed_months(datetime(2022, 1, 31), datetime(2022, 2, 28)), 1)
+        self.assertEqual(count_elapsed_months(datetime(2022, 1, 15), datetime(2023, 1, 15)), 12)
+        self.assertEqual(count_elapsed_months(datetime(2022, 1, 15), datetime(2021, 1, 15)), 0)
+
     def test_account_balance(self) -> None:
         url = "/api/auth/profile/"
         self.create_transaction(amount=23)
@@ -28,6 +80,68 @@ class AccountingTestCase(CapsuleMixin, TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["account_balance"], str(Decimal("-9.00")))
 
+    def test_account_balance_is_updated_with_transactions(self):
+        self.create_transaction(amount=23)
+        self.create_transaction(amount=-32)
+        self.assertEqual(self._get_account_balance(), Decimal(-9))
+        self.transaction.amount = -30
+        self.transaction.save()
+        self.assertEqual(self._get_account_balance(), Decimal(-7))
+        self.transaction.delete()
+        self.assertEqual(self._get_account_balance(), Decimal(23))
+
+    def test_account_balance_is_updated_with_deleted_queryset(self):
+        self.create_transaction(amount=10)
+        self.create_transaction(amount=5)
+        Transaction.objects.filter(pk=self.transaction.pk).delete()
+        self.assertEqual(self._get_account_balance(), Decimal(10))
+        Transaction.objects.all().delete()
+        self.assertEqual(self._get_account_balance(), Decimal(0))
+
+    def test_account_holder_is_deleted_with_transactions(self):
+        self.create_transaction(amount=10)
+        self.user.delete()
+        self.assertFalse(AccountBalance.objects.exists())
+
+    def test_account_balance_is_updated_with_bulk_created_transactions(self):
+        self.create_capsule()
+        Capsule.objects.update(created_on=now() - relativedelta(months=2, days=1))
+        management.call_command("chargedues")
+        self.assertEqual(self._get_account_balance(), -2 * settings.MONTHLY_DUE_PER_CAPSULE)
+
+    @override_settings(ACCOUNT_BALANCE_UPDATE_BATCH_SIZE=2)
+    def test_account_balances_are_updated_in_batches(self):
+        users = [self.create_user() for _ in range(3)]
+        # savepoint, two batches each of created and updated balances and release savepoint
+        with self.assertNumQueries(6):
+            AccountBalance.objects.add({user.pk: Decimal(i + 1) for i, user in enumerate(users)})
+        for i, user in enumerate(users):
+            self.assertEqual(AccountBalance.objects.get(account_holder=user).amount, Decimal(i + 1))
+
+    def test_account_balance_queries_do_not_depend_on_transaction_count(self):
+        url = "/api/auth/profile/"
+        for _ in range(3):
+            self.create_transaction()
+        self.authenticate_user()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any("accounting_transaction" in query["sql"] for query in queries.captured_queries))
+
+    def test_reconcile_balances(self):
+        self.create_transaction(amount=23)
+        AccountBalance.objects.update(amount=42)
+        output = StringIO()
+        with self.assertLogs("memoorje.accounting.management.commands.reconcilebalances", "WARNING"):
+            management.call_command("reconcilebalances", stdout=output)
+        self.assertIn("1 account balances differ", output.getvalue())
+        self.assertEqual(self._get_account_balance(), Decimal(42))
+        with self.assertLogs("memoorje.accounting.management.commands.reconcilebalances", "WARNING"):
+            management.call_command("reconcilebalances", fix=True, stdout=output)
+        self.assertEqual(self._get_account_balance(), Decimal(23))
+        output = StringIO()
+        management.call_command("reconcilebalances", stdout=output)
+        self.assertEqual(output.getvalue(), "")
+
     def test_list_transactions(self):
         url = "/api/accounting/transactions/"
         self.create_transaction()
@@ -35,7 +149,7 @@ class AccountingTestCase(CapsuleMixin, TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertListEqual(
-            json.loads(response.content),
+            json.loads(response.content)["results"],
             [
                 {
                     "amount": format_decimal(self.transaction.amount, ".01"),
@@ -46,6 +160,37 @@ class AccountingTestCase(CapsuleMixin, TestCase):
             ],
         )
 
+    def test_list_transactions_paginated(self):
+        url = "/api/accounting/transactions/"
+        for _ in range(5):
+            self.create_transaction()
+        self.authenticate_user()
+        ids = []
+        response = self.client.get(url, {"page_size": 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            content = json.loads(response.content)
+            self.assertLessEqual(len(content["results"]), 2)
+            ids.extend(transaction["id"] for transaction in content["results"])
+            if content["next"] is None:
+                break
+            response = self.client.get(content["next"])
+        self.assertListEqual(
+            ids, list(self.user.transactions.order_by("created_on", "id").values_list("id", flat=True))
+        )
+
+    def test_list_transactions_since(self):
+        url = "/api/accounting/transactions/"
+        self.create_transaction()
+        since = self.transaction.created_on
+        self.create_transaction()
+        self.authenticate_user()
+        response = self.client.get(url, {"since": since.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(
+            [transaction["id"] for transaction in json.loads(response.content)["results"]], [self.transaction.id]
+        )
+
     def test_list_expense_types(self):
         url = "/api/accounting/expense-types/"
         self.create_capsule()
@@ -70,6 +215,37 @@ class AccountingTestCase(CapsuleMixin, TestCase):
             ],
         )
 
+    def _get_account_balance(self):
+        return AccountBalance.objects.get(account_holder=self.user).amount
+
+    def test_list_expense_types_queries(self):
+        url = "/api/accounting/expense-types/"
+        self.create_capsule()
+        for _ in range(3):
+            self.create_expense_type()
+            self.create_expense(expense_type=self.expense_type)
+        self.authenticate_user()
+        cache.clear()
+        # session, user, expense types and (cached) amount sums
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+    def test_expense_amount_sums_are_refreshed(self):
+        self.create_capsule()
+        self.create_expense_type()
+        self.create_expense(expense_type=self.expense_type, amount=10)
+        self.assertEqual(get_expense_amount_sums_per_capsule(), {self.expense_type.pk: Decimal(10)})
+        self.create_expense(expense_type=self.expense_type, amount=5)
+        self.assertEqual(get_expense_amount_sums_per_capsule(), {self.expense_type.pk: Decimal(15)})
+        self.expense_type.delete()
+        self.assertEqual(get_expense_amount_sums_per_capsule(), {None: Decimal(15)})
+
+    def test_expense_amount_sums_without_capsules(self):
+        self.create_expense(amount=10)
+        self.assertEqual(Expense.objects.get_amount_sums_per_capsule(), {None: Decimal(10)})
+
     def create_expense(self, amount=123, expense_type=None):
         self.expense = Expense.objects.create(amount=amount, type=expense_type)
         self.expense.refresh_from_db()
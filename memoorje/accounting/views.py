@@ -1,6 +1,9 @@
+from django.conf import settings
+from django_filters import rest_framework as filters
 from rest_framework import mixins, viewsets
+from rest_framework.pagination import CursorPagination
 
-from memoorje.accounting.models import ExpenseType
+from memoorje.accounting.models import ExpenseType, Transaction
 from memoorje.accounting.serializers import ExpenseTypeSerializer, TransactionSerializer
 
 
@@ -9,8 +12,25 @@ class ExpenseTypeViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = ExpenseTypeSerializer
 
 
+class TransactionFilterSet(filters.FilterSet):
+    since = filters.IsoDateTimeFilter(field_name="created_on", lookup_expr="gt")
+
+    class Meta:
+        model = Transaction
+        fields = ["since"]
+
+
+class TransactionPagination(CursorPagination):
+    ordering = ["created_on", "id"]
+    page_size = settings.TRANSACTION_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.TRANSACTION_PAGE_SIZE
+
+
 class TransactionViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = TransactionSerializer
+    filterset_class = TransactionFilterSet
+    pagination_class = TransactionPagination
 
     def get_queryset(self):
-        return self.request.user.transactions.order_by("created_on")
+        return self.request.user.transactions.order_by("created_on", "id")
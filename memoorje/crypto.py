@@ -1,12 +1,18 @@
+import atexit
+from concurrent.futures import Executor, Future
+import functools
+import os
 import secrets
 import string
 import struct
 import subprocess
-from typing import Iterable, Mapping
+from typing import Iterable, List, Mapping, Optional, Sequence, Union
 
 from django.conf import settings
+from django.utils.module_loading import import_string
 from memoorje_crypto.formats import EncryptionV1
 
+from memoorje import secret_sharing
 from memoorje.models import Capsule, CapsuleRecipient, Keyslot, PartialKey
 
 
@@ -14,14 +20,62 @@ class RecryptError(Exception):
     pass
 
 
-def recrypt_capsule(capsule: "Capsule", partial_keys: Iterable["PartialKey"]) -> Mapping["CapsuleRecipient", str]:
-    password = _combine_partial_keys(partial_keys)
+class PendingKeyslots:
+    """
+    Password keyslots for the recipients of a capsule whose encryption has been started but which aren't stored yet.
+    """
+
+    def __init__(self, capsule: "Capsule"):
+        self.capsule = capsule
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, recipient: "CapsuleRecipient", password: str, data: "Future[bytes]"):
+        self._entries.append((recipient, password, data))
+
+    def create(self) -> Mapping["CapsuleRecipient", str]:
+        """
+        Wait for the encryption of all keyslots to finish and store them.
+
+        :return: The new password for each recipient.
+        """
+        keyslots = [
+            Keyslot(capsule=self.capsule, purpose=Keyslot.Purpose.PASSWORD, data=data.result(), recipient=recipient)
+            for recipient, _, data in self._entries
+        ]
+        Keyslot.objects.bulk_create(keyslots)
+        return {recipient: password for recipient, password, _ in self._entries}
+
+
+def start_recrypt(
+    capsule: "Capsule",
+    partial_keys: Iterable["PartialKey"],
+    executor: Optional[Executor] = None,
+    password: Optional[bytes] = None,
+) -> PendingKeyslots:
+    """
+    Recover the secret of the capsule and start encrypting it for each recipient. If an executor is given the
+    (expensive) encryption is done by the executor, otherwise it is done right away.
+
+    :param password: The combined partial keys, if they were already combined (see combine_partial_key_sets()).
+    """
+    if password is None:
+        password = _combine_partial_keys(partial_keys)
     secret = _decrypt_secret(capsule, password)
-    return _create_recipient_keyslots(capsule, secret)
+    return _start_recipient_keyslots(capsule, secret, executor)
 
 
-def _combine_partial_keys(partial_keys: Iterable["PartialKey"]) -> bytes:
-    keys_as_input_str = "\n".join([key.data.hex() for key in partial_keys])
+def combine_shares_in_process(shares: Sequence[bytes]) -> bytes:
+    try:
+        return secret_sharing.combine_shares(shares)
+    except secret_sharing.CombineError as e:
+        raise RecryptError(f"Combining partial keys failed ({e}).") from e
+
+
+def combine_shares_with_subprocess(shares: Sequence[bytes]) -> bytes:
+    keys_as_input_str = "\n".join([share.hex() for share in shares])
     with subprocess.Popen(
         [settings.SECRET_SHARE_COMBINE_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE
     ) as combine_process:
@@ -32,23 +86,76 @@ def _combine_partial_keys(partial_keys: Iterable["PartialKey"]) -> bytes:
         raise RecryptError("secret-share-combine returned non-zero exit status.")
 
 
-def _create_recipient_keyslots(capsule: "Capsule", secret: bytes) -> Mapping["CapsuleRecipient", str]:
-    result = {}
+def combine_shares_with_worker_pool(shares: Sequence[bytes]) -> bytes:
+    try:
+        return get_combine_worker_pool().combine(shares)
+    except secret_sharing.CombineError as e:
+        raise RecryptError(f"Combining partial keys failed ({e}).") from e
+
+
+def combine_partial_key_sets(partial_key_sets: Iterable[Iterable["PartialKey"]]) -> List[Union[bytes, RecryptError]]:
+    """
+    Combine the partial keys of multiple capsules. The worker pool backend combines them in parallel, the other backends
+    one after the other.
+
+    :return: The combined partial keys or the error for each set of partial keys.
+    """
+    share_sets = [[bytes(key.data) for key in partial_keys] for partial_keys in partial_key_sets]
+    combine_shares = import_string(settings.SECRET_SHARE_COMBINE_BACKEND)
+    if combine_shares is combine_shares_with_worker_pool:
+        return [
+            RecryptError(f"Combining partial keys failed ({result}).") if isinstance(result, Exception) else result
+            for result in get_combine_worker_pool().map(share_sets, return_exceptions=True)
+        ]
+    results = []
+    for shares in share_sets:
+        try:
+            results.append(combine_shares(shares))
+        except RecryptError as e:
+            results.append(e)
+    return results
+
+
+@functools.lru_cache(maxsize=None)
+def get_combine_worker_pool() -> secret_sharing.CombineWorkerPool:
+    pool = secret_sharing.CombineWorkerPool(
+        settings.SECRET_SHARE_COMBINE_WORKER_COMMAND,
+        size=settings.SECRET_SHARE_COMBINE_WORKERS or os.cpu_count() or 1,
+        timeout=settings.SECRET_SHARE_COMBINE_TIMEOUT_SECONDS,
+    )
+    atexit.register(pool.close)
+    return pool
+
+
+def _combine_partial_keys(partial_keys: Iterable["PartialKey"]) -> bytes:
+    combine_shares = import_string(settings.SECRET_SHARE_COMBINE_BACKEND)
+    return combine_shares([bytes(key.data) for key in partial_keys])
+
+
+def _create_recipient_keyslots(
+    capsule: "Capsule", secret: bytes, executor: Optional[Executor] = None
+) -> Mapping["CapsuleRecipient", str]:
+    return _start_recipient_keyslots(capsule, secret, executor).create()
+
+
+def _start_recipient_keyslots(
+    capsule: "Capsule", secret: bytes, executor: Optional[Executor] = None
+) -> PendingKeyslots:
+    result = PendingKeyslots(capsule)
     for recipient in capsule.recipients.all():
         new_password = _generate_password()
-        new_data = _encrypt_secret(secret, new_password.encode())
-        capsule.keyslots.create(purpose=Keyslot.Purpose.PASSWORD, data=new_data, recipient=recipient)
-        result[recipient] = new_password
+        result.add(recipient, new_password, _submit(executor, _encrypt_secret, secret, new_password.encode()))
     return result
 
 
 def _decrypt_secret(capsule: "Capsule", sss_password: bytes) -> bytes:
+    # filtering the keyslots in Python makes use of keyslots prefetched with the capsule
+    sss_keyslots = [keyslot for keyslot in capsule.keyslots.all() if keyslot.purpose == Keyslot.Purpose.SSS]
+    if len(sss_keyslots) != 1:
+        raise RecryptError(f"Not exactly one keyslot with purpose SSS found for capsule {capsule.pk}.")
     try:
-        sss_keyslot = capsule.keyslots.get(purpose=Keyslot.Purpose.SSS)
-        secret = sss_keyslot.decrypt(sss_password)
+        secret = sss_keyslots[0].decrypt(sss_password)
         return secret
-    except (Keyslot.DoesNotExist, Keyslot.MultipleObjectsReturned) as e:
-        raise RecryptError(f"Not exactly one keyslot with purpose SSS found for capsule {capsule.pk}.") from e
     except struct.error as e:
         raise RecryptError(f"Decryption of secret failed for capsule {capsule.pk}.") from e
 
@@ -63,3 +170,12 @@ def _encrypt_secret(secret: bytes, password: bytes) -> bytes:
 def _generate_password() -> str:
     alphabet = string.ascii_letters + string.digits + string.punctuation
     return "".join(secrets.choice(alphabet) for _ in range(settings.RECIPIENT_PASSWORD_LENGTH))
+
+
+def _submit(executor: Optional[Executor], fn, *args) -> Future:
+    if executor is not None:
+        return executor.submit(fn, *args)
+    # without an executor the function is called immediately
+    future = Future()
+    future.set_result(fn(*args))
+    return future
@@ -2,8 +2,7 @@ from django.conf import settings
 from django.db.models import FileField
 from django.db.models.fields.files import FieldFile
 from django.urls import reverse
-
-from memoorje.data_storage.storage import CapsuleDataStorage
+from django.utils.module_loading import import_string
 
 
 class CapsuleDataFile(FieldFile):
@@ -17,5 +16,5 @@ class CapsuleDataField(FileField):
     attr_class = CapsuleDataFile
 
     def __init__(self, **kwargs):
-        kwargs.setdefault("storage", CapsuleDataStorage(location=settings.CAPSULE_DATA_DIR))
+        kwargs.setdefault("storage", import_string(settings.CAPSULE_DATA_STORAGE)(location=settings.CAPSULE_DATA_DIR))
         super().__init__(**kwargs)
@@ -1,9 +1,29 @@
+from django.db import transaction
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 
-from memoorje.models import CapsuleContent
+from memoorje.models import CapsuleContent, CapsuleContentUpload
 
 
 @receiver(pre_delete, sender=CapsuleContent)
 def delete_data_file(sender, instance: CapsuleContent, **kwargs):
-    instance.data.delete(False)
+    storage = instance.data.storage
+    if not storage.is_shared:
+        instance.data.delete(False)
+        return
+    name = instance.data.name
+
+    def delete_unreferenced_data_file():
+        # capsule contents saving the same data meanwhile either find the file or write it again (see storage._save)
+        with storage.lock():
+            if not CapsuleContent.objects.filter(data=name).exists():
+                storage.delete(name)
+
+    # the references are checked once the deletion of the capsule content is committed
+    transaction.on_commit(delete_unreferenced_data_file)
+
+
+@receiver(pre_delete, sender=CapsuleContentUpload)
+def delete_upload_file(sender, instance: CapsuleContentUpload, **kwargs):
+    if instance.file_name:
+        instance.storage.delete(instance.file_name)
@@ -1,11 +1,91 @@
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import os
 import uuid
 
+from django.core.files.base import ContentFile
 from django.core.files.storage import FileSystemStorage
 
 
 class CapsuleDataStorage(FileSystemStorage):
+    # whether a file might be used by multiple capsule contents
+    is_shared = False
+
     def get_valid_name(self, name):
         return str(uuid.uuid4())
 
     def url(self, name):
         raise NotImplementedError("use url property of CapsuleDataField instead")
+
+    def create_upload_file(self) -> str:
+        """Create an empty file for a chunked upload and return its name (see complete_upload_file())."""
+        return self.save("upload", ContentFile(b""))
+
+    def complete_upload_file(self, name: str, sha256: bytes) -> str:
+        """Return the name of the file for the completed upload with the given name and SHA-256 hash."""
+        return name
+
+
+class ContentAddressedCapsuleDataStorage(CapsuleDataStorage):
+    """
+    Stores files named by the SHA-256 hash of their content, so identical files are stored only once.
+
+    Files are placed in a directory tree sharded by the first bytes of the hash. As a file might be shared by multiple
+    capsule contents, it is only deleted with the last capsule content referencing it (see signals.delete_data_file).
+    Reusing and deleting files is serialized across processes by the lock of the storage.
+    """
+
+    is_shared = True
+    temporary_dir = "tmp"
+
+    def get_content_name(self, sha256: bytes) -> str:
+        hex_digest = sha256.hex()
+        return f"{hex_digest[:2]}/{hex_digest[2:4]}/{hex_digest}"
+
+    def _save(self, name, content):
+        data_hash = hashlib.sha256()
+        for chunk in content.chunks():
+            data_hash.update(chunk)
+        name = self.get_content_name(data_hash.digest())
+        # the data is written before taking the lock, as it might take a while
+        temporary_name = None if self.exists(name) else super()._save(self._get_temporary_name(), content)
+        with self.lock():
+            if self.exists(name):
+                if temporary_name is not None:
+                    self.delete(temporary_name)
+            else:
+                # The file is moved into place once written completely. It is written again if it was deleted since the
+                # check above.
+                self._move(temporary_name or super()._save(self._get_temporary_name(), content), name)
+        return name
+
+    def create_upload_file(self) -> str:
+        return super()._save(self._get_temporary_name(), ContentFile(b""))
+
+    def complete_upload_file(self, name: str, sha256: bytes) -> str:
+        content_name = self.get_content_name(sha256)
+        with self.lock():
+            if self.exists(content_name):
+                self.delete(name)
+            else:
+                self._move(name, content_name)
+        return content_name
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the files of this storage, which is shared by all processes using the storage."""
+        lock_path = self.path(f"{self.temporary_dir}/.lock")
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "a") as lock_file:
+            # the lock is released when the file is closed
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _get_temporary_name(self) -> str:
+        return f"{self.temporary_dir}/{uuid.uuid4()}"
+
+    def _move(self, source_name: str, target_name: str):
+        target_path = self.path(target_name)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(self.path(source_name), target_path)
@@ -1,6 +1,16 @@
-from django.test import TestCase
+from contextlib import contextmanager
+import hashlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.test import override_settings, TestCase
 from rest_framework import status
 
+from memoorje.data_storage.storage import ContentAddressedCapsuleDataStorage
+from memoorje.models import CapsuleContent
 from memoorje.tests.mixins import CapsuleContentMixin, CapsuleRecipientMixin
 
 
@@ -36,3 +46,200 @@ class CapsuleContentTestCase(CapsuleContentMixin, CapsuleRecipientMixin, TestCas
         response = self.client.get(url, **self.get_request_headers_with_recipient_token())
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_download_data_range(self):
+        """
+        Download a part of the file for a capsule content.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        response = self.client.get(url, HTTP_RANGE="bytes=5-12")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], f"bytes 5-12/{len(self.data)}")
+        self.assertEqual(b"".join(response.streaming_content), self.data[5:13])
+
+    def test_download_data_suffix_range(self):
+        """
+        Download the end of the file for a capsule content.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        response = self.client.get(url, HTTP_RANGE="bytes=-4")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.data[-4:])
+
+    def test_download_data_unsatisfiable_range(self):
+        """
+        Try to download a part of the file beyond its end.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        response = self.client.get(url, HTTP_RANGE=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_download_data_range_of_changed_file(self):
+        """
+        Resuming a download of a file which changed in the meantime returns the whole file.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        response = self.client.get(url, HTTP_RANGE="bytes=5-", HTTP_IF_RANGE='"0-0"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_download_data_not_modified(self):
+        """
+        Download the file for a capsule content with a matching ETag.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, HTTP_RANGE="bytes=5-", HTTP_IF_RANGE=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+    def test_download_data_queries(self):
+        """
+        Access to the file is checked with the query fetching the capsule content.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        # session, user and capsule content (with capsule)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+    @override_settings(CAPSULE_DATA_DOWNLOAD_OFFLOAD="x-accel-redirect")
+    def test_download_data_with_x_accel_redirect(self):
+        """
+        Download the file for a capsule content via the web server (X-Accel-Redirect).
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.authenticate_user()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._serve_internal_redirect(response["X-Accel-Redirect"]), self.data)
+
+    @override_settings(CAPSULE_DATA_DOWNLOAD_OFFLOAD="x-accel-redirect")
+    def test_download_data_with_x_accel_redirect_unauthorized(self):
+        """
+        Try to download the file for a capsule content belonging to another user via the web server.
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        self.create_user()
+        self.authenticate_user()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    @override_settings(CAPSULE_DATA_DOWNLOAD_OFFLOAD="x-sendfile")
+    def test_download_data_with_x_sendfile(self):
+        """
+        Download the file for a capsule content via the web server (X-Sendfile).
+        """
+        self.create_capsule_content()
+        url = self.capsule_content.data.url
+        response = self.client.get(url, **self.get_request_headers_with_recipient_token())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Path(response["X-Sendfile"]).read_bytes(), self.data)
+
+    def _serve_internal_redirect(self, redirect_url):
+        # stands in for the internal nginx location mapping CAPSULE_DATA_INTERNAL_URL to CAPSULE_DATA_DIR
+        self.assertTrue(redirect_url.startswith(settings.CAPSULE_DATA_INTERNAL_URL))
+        return (
+            Path(settings.CAPSULE_DATA_DIR) / unquote(redirect_url[len(settings.CAPSULE_DATA_INTERNAL_URL) :])
+        ).read_bytes()
+
+
+class ContentAddressedStorageTestCase(CapsuleContentMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        temporary_directory = TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.storage = ContentAddressedCapsuleDataStorage(location=temporary_directory.name)
+        patcher = mock.patch.object(CapsuleContent._meta.get_field("data"), "storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_data_is_stored_once(self):
+        """
+        Identical data of two capsule contents is stored in a single file.
+        """
+        self.create_capsule_content()
+        first_content = self.capsule_content
+        self.create_capsule_content()
+        self.assertEqual(first_content.data.name, self.capsule_content.data.name)
+        self.assertEqual(first_content.data.name, self.storage.get_content_name(hashlib.sha256(self.data).digest()))
+        self.assertEqual(Path(self.capsule_content.data.path).read_bytes(), self.data)
+        self.assertEqual(len(list(Path(self.storage.location).glob("*/*/*"))), 1)
+
+    def test_shared_data_is_deleted_with_last_reference(self):
+        """
+        A shared file is deleted with the last capsule content referencing it.
+        """
+        self.create_capsule_content()
+        first_content = self.capsule_content
+        self.create_capsule_content()
+        file_path = Path(self.capsule_content.data.path)
+        with self.captureOnCommitCallbacks(execute=True):
+            first_content.delete()
+        self.assertTrue(file_path.is_file())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.capsule_content.delete()
+        self.assertFalse(file_path.is_file())
+
+    def test_shared_data_is_kept_if_saved_again_before_commit(self):
+        """
+        A file is kept if a capsule content referencing it is saved before the deletion of the last one is committed.
+        """
+        self.create_capsule_content()
+        file_path = Path(self.capsule_content.data.path)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.capsule_content.delete()
+        self.create_capsule_content()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(file_path.read_bytes(), self.data)
+
+    def test_missing_shared_data_is_written_again(self):
+        """
+        A file deleted after checking for its existence is written again.
+        """
+        self.create_capsule_content()
+        file_path = Path(self.capsule_content.data.path)
+        lock = self.storage.lock
+
+        @contextmanager
+        def delete_and_lock():
+            # another process deleted the file in the meantime
+            file_path.unlink()
+            with lock():
+                yield
+
+        with mock.patch.object(self.storage, "lock", delete_and_lock):
+            self.create_capsule_content()
+        self.assertEqual(
+            self.capsule_content.data.name, self.storage.get_content_name(hashlib.sha256(self.data).digest())
+        )
+        self.assertEqual(file_path.read_bytes(), self.data)
+
+    def test_completed_upload_is_stored_by_content(self):
+        """
+        A completed upload is moved to the name derived from its data.
+        """
+        self.create_capsule_content()
+        name = self.storage.create_upload_file()
+        with self.storage.open(name, "wb") as f:
+            f.write(self.data)
+        content_name = self.storage.complete_upload_file(name, hashlib.sha256(self.data).digest())
+        self.assertEqual(content_name, self.capsule_content.data.name)
+        self.assertFalse(self.storage.exists(name))
@@ -1,18 +1,148 @@
+import os
+import re
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.db.models import Exists, OuterRef
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
 from django_downloadview import ObjectDownloadView
+from django_downloadview.apache.response import XSendfileResponse
+from django_downloadview.exceptions import FileNotFound
+from django_downloadview.nginx.response import XAccelRedirectResponse
+from django_downloadview.response import content_disposition
 
-from memoorje.models import CapsuleContent
+from memoorje.models import CapsuleContent, CapsuleRecipient
 from memoorje.utils import get_recipient_by_token
 
+RANGE_CHUNK_SIZE = 64 * 1024
+
+_BYTE_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
 
 class CapsuleDataDownloadView(UserPassesTestMixin, ObjectDownloadView):
+    """
+    Download the data of a capsule content.
+
+    Conditional requests (based on ETag and Last-Modified) and single byte ranges are supported, so interrupted
+    downloads can be resumed. After checking the access, the download can be handed off to the web server (see
+    CAPSULE_DATA_DOWNLOAD_OFFLOAD).
+    """
+
     model = CapsuleContent
     file_field = "data"
     raise_exception = True
 
-    def test_func(self):
-        content: CapsuleContent = self.get_object()
+    def get_queryset(self):
+        queryset = CapsuleContent.objects.select_related("capsule")
         recipient = get_recipient_by_token(self.request)
-        return (content.capsule.owner == self.request.user) or (
-            recipient is not None and content.capsule.recipients.filter(pk=recipient.pk).exists()
+        if recipient is not None:
+            # the recipient might have been deleted since its token was cached
+            queryset = queryset.annotate(
+                is_received=Exists(CapsuleRecipient.objects.filter(pk=recipient.pk, capsule=OuterRef("capsule")))
+            )
+        return queryset
+
+    def test_func(self):
+        # the content is fetched only once: it is used for the access check and the download
+        self.object: CapsuleContent = self.get_object()
+        return self.object.capsule.owner_id == self.request.user.pk or getattr(self.object, "is_received", False)
+
+    def get(self, request, *args, **kwargs):
+        return self.render_to_response()
+
+    def render_to_response(self, *response_args, **response_kwargs):
+        try:
+            self.file_instance = self.get_file()
+            size = self.file_instance.size
+            last_modified = int(self.file_instance.storage.get_modified_time(self.file_instance.name).timestamp())
+        except (FileNotFound, FileNotFoundError):
+            return self.file_not_found_response()
+        etag = f'"{last_modified:x}-{size:x}"'
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            # an offloading web server handles byte ranges on its own
+            byte_range = (
+                None if settings.CAPSULE_DATA_DOWNLOAD_OFFLOAD else self.get_byte_range(size, etag, last_modified)
+            )
+            if byte_range is None:
+                response = self.download_response(*response_args, **response_kwargs)
+            elif byte_range[0] >= size:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+            else:
+                response = self.partial_download_response(*byte_range, size)
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def get_byte_range(self, size: int, etag: str, last_modified: int) -> Optional[Tuple[int, int]]:
+        """
+        The requested byte range as (first byte, last byte) clipped to the file size. The first byte is beyond the file
+        if the range cannot be satisfied.
+
+        :return: None if the whole file should be sent (no range requested, a changed file or an unsupported range).
+        """
+        header = self.request.headers.get("Range")
+        if header is None or self.request.method not in ("GET", "HEAD"):
+            return None
+        if_range = self.request.headers.get("If-Range")
+        if if_range is not None and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+            return None
+        match = _BYTE_RANGE_PATTERN.match(header.strip())
+        if match is None:
+            # multiple ranges aren't supported
+            return None
+        first, last = match.groups()
+        if first == "" and last == "":
+            return None
+        if first == "":
+            # the last n bytes
+            return max(size - int(last), 0), size - 1
+        if last != "" and int(last) < int(first):
+            return None
+        return int(first), min(int(last), size - 1) if last != "" else size - 1
+
+    def download_response(self, *response_args, **response_kwargs):
+        basename = self.get_basename() or os.path.basename(self.file_instance.name)
+        if settings.CAPSULE_DATA_DOWNLOAD_OFFLOAD == "x-accel-redirect":
+            return XAccelRedirectResponse(
+                settings.CAPSULE_DATA_INTERNAL_URL + quote(self.file_instance.name),
+                "application/octet-stream",
+                basename=basename,
+                attachment=self.attachment,
+            )
+        if settings.CAPSULE_DATA_DOWNLOAD_OFFLOAD == "x-sendfile":
+            return XSendfileResponse(
+                self.file_instance.path, "application/octet-stream", basename=basename, attachment=self.attachment
+            )
+        return super().download_response(*response_args, **response_kwargs)
+
+    def partial_download_response(self, first: int, last: int, size: int):
+        response = StreamingHttpResponse(
+            _read_file_range(self.file_instance, first, last - first + 1),
+            status=206,
+            content_type="application/octet-stream",
         )
+        response["Content-Length"] = last - first + 1
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        if self.attachment:
+            response["Content-Disposition"] = content_disposition(
+                self.get_basename() or os.path.basename(self.file_instance.name)
+            )
+        return response
+
+
+def _read_file_range(file_instance, start: int, length: int):
+    with file_instance.storage.open(file_instance.name, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
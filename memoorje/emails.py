@@ -1,16 +1,31 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import functools
+import logging
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple
 from urllib.parse import quote_plus
 
 from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections
+from django.template import Context, loader
 from django.utils import translation
 from djeveric.emails import ConfirmationEmail
 from html2text import HTML2Text
+from render_block import BlockNotFound
+from render_block.django import django_render_block
 from rest_registration.signers.register import RegisterSigner
 from rest_registration.signers.reset_password import ResetPasswordSigner
 from rest_registration.utils.users import get_user_verification_id
-from templated_email import get_templated_mail
+from templated_email.backends.vanilla_django import EmailRenderException, TemplateBackend
+
+logger = logging.getLogger(__name__)
 
 
 def convert_html_to_text(html):
+    # The results are not kept, as emails contain passwords and personal links. Converters keep parser state between
+    # conversions, so each conversion uses a new one.
     converter = HTML2Text()
     converter.inline_links = False
     converter.protect_links = False
@@ -19,6 +34,137 @@ def convert_html_to_text(html):
     return converter.handle(html)
 
 
+class EmailRenderer(TemplateBackend):
+    """
+    Renders email messages from templates. The compiled templates are kept, so they are loaded only once per process.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._templates = {}
+
+    def get_template(self, template_name):
+        # Compiled templates don't depend on the active language (it only matters when rendering).
+        if template_name not in self._templates or settings.DEBUG:
+            self._templates[template_name] = loader.get_template(
+                f"{self.template_prefix}{template_name}.{self.template_suffix.lstrip('.')}"
+            )
+        return self._templates[template_name]
+
+    def _render_email(self, template_name, context, template_dir=None, file_extension=None):
+        template = self.get_template(template_name)
+        response = {}
+        for part in ["subject", "html", "plain"]:
+            try:
+                response[part] = django_render_block(template, part, Context(context, autoescape=(part == "html")))
+            except BlockNotFound:
+                pass
+        if response == {}:
+            raise EmailRenderException(f"Couldn't render email parts of {template_name}.")
+        return response
+
+    def render(self, template_name: str, context: Mapping, to: Sequence[str]) -> EmailMessage:
+        return self.get_email_message(template_name, dict(context), to=list(to))
+
+    def render_many(self, template_name: str, contexts: Iterable[Tuple[Mapping, Sequence[str]]]) -> List[EmailMessage]:
+        """Render a message for each pair of context and recipients."""
+        return [self.render(template_name, context, to) for context, to in contexts]
+
+
+@functools.lru_cache(maxsize=None)
+def get_email_renderer() -> EmailRenderer:
+    return EmailRenderer()
+
+
+def send_messages(messages: Sequence[EmailMessage], fail_silently: bool = False) -> List[bool]:
+    """
+    Send the messages through a single connection or add them to the email queue.
+
+    Without fail_silently the first error is raised. Otherwise, each message is sent on its own and failures are logged,
+    so the caller can tell which messages were sent (or queued) from the returned flags.
+    """
+    if settings.EMAIL_QUEUE_ENABLED:
+        from memoorje.models import QueuedEmail
+
+        QueuedEmail.objects.bulk_create([email for message in messages for email in QueuedEmail.from_message(message)])
+        return [True] * len(messages)
+    if len(messages) == 0:
+        return []
+    if not fail_silently:
+        get_connection().send_messages(messages)
+        return [True] * len(messages)
+    results = []
+    connection = get_connection()
+    try:
+        for message in messages:
+            try:
+                connection.send_messages([message])
+                results.append(True)
+            except Exception as e:
+                logger.warning(f"Sending email to {', '.join(message.to)} failed ({e})")
+                results.append(False)
+                reopen_connection(connection)
+    finally:
+        connection.close()
+    return results
+
+
+def reopen_connection(connection):
+    # The connection might be broken after an error. Otherwise, the backend would open a new connection per email.
+    connection.close()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning(f"Reopening the email connection failed ({e})")
+
+
+def send_templated_emails(
+    emails: Iterable[Tuple["TemplatedEmail", Mapping]], workers: int = 1, fail_silently: bool = False
+) -> List[bool]:
+    """
+    Render all given emails (with their send() keyword arguments) and send them at once.
+
+    The emails are grouped by language, so each group is rendered with a single activation of its language. With more
+    than one worker the groups are rendered concurrently. Returns whether each email was sent (see send_messages()).
+    """
+    groups = defaultdict(list)
+    indexes = defaultdict(list)
+    for index, (email, kwargs) in enumerate(emails):
+        language = email.get_language(**kwargs)
+        groups[language].append((email, kwargs))
+        indexes[language].append(index)
+    if workers > 1 and len(groups) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rendered_groups = list(executor.map(_render_email_group_in_thread, groups.items()))
+    else:
+        rendered_groups = [_render_email_group(group) for group in groups.items()]
+    sent = send_messages([message for messages in rendered_groups for message in messages], fail_silently)
+    # restore the order of the given emails
+    results = [False] * len(sent)
+    for index, is_sent in zip((index for language in groups for index in indexes[language]), sent):
+        results[index] = is_sent
+    return results
+
+
+def _override_language(language: Optional[str]):
+    # The language is only activated for the current thread and restored afterwards.
+    return translation.override(language) if language is not None else nullcontext()
+
+
+def _render_email_group(group: Tuple[Optional[str], Sequence[Tuple["TemplatedEmail", Mapping]]]) -> List[EmailMessage]:
+    language, emails = group
+    with _override_language(language):
+        return [email.render_in_active_language(**kwargs) for email, kwargs in emails]
+
+
+def _render_email_group_in_thread(group) -> List[EmailMessage]:
+    try:
+        return _render_email_group(group)
+    finally:
+        # database connections are opened per thread
+        connections.close_all()
+
+
 class TemplatedEmail(ConfirmationEmail):
     template_name: str
 
@@ -34,6 +180,8 @@ class TemplatedEmail(ConfirmationEmail):
             instance = kwargs["instance"]
             if hasattr(instance, "language"):
                 return instance.language
+            if hasattr(instance, "owner"):
+                return instance.owner.language
             if hasattr(instance, "capsule"):
                 return instance.capsule.owner.language
         return None
@@ -41,17 +189,15 @@ class TemplatedEmail(ConfirmationEmail):
     def get_template_name(self):
         return self.template_name
 
+    def render(self, **kwargs) -> EmailMessage:
+        with _override_language(self.get_language(**kwargs)):
+            return self.render_in_active_language(**kwargs)
+
+    def render_in_active_language(self, **kwargs) -> EmailMessage:
+        return get_email_renderer().render(self.get_template_name(), self.get_context(**kwargs), [self.email])
+
     def send(self, **kwargs):
-        template_name = self.get_template_name()
-        language = self.get_language(**kwargs)
-        if language is not None:
-            translation.activate(language)
-        mail = get_templated_mail(
-            context=self.get_context(**kwargs),
-            template_name=template_name,
-            to=[self.email],
-        )
-        mail.send()
+        send_messages([self.render(**kwargs)])
 
 
 # mails sent to the capsule owner
@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+from django.utils.timezone import now
+
+from memoorje.models import CapsuleContentUpload
+
+
+class Command(BaseCommand):
+    help = "Deletes capsule content uploads which were abandoned before being completed"
+
+    def handle(self, *args, **options):
+        # the data received so far is deleted along with each upload
+        deleted_count, _ = CapsuleContentUpload.objects.expired(now()).delete()
+        if deleted_count:
+            self.stdout.write(f"Deleted {deleted_count} expired uploads.")
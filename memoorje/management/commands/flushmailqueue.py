@@ -0,0 +1,89 @@
+from datetime import timedelta
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+
+from memoorje.emails import reopen_connection
+from memoorje.models import QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Sends queued emails"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.EMAIL_QUEUE_BATCH_SIZE,
+            help="Number of emails taken from the queue at once",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=settings.EMAIL_QUEUE_RATE_LIMIT,
+            help="Maximum number of emails sent per second",
+        )
+
+    def handle(self, *args, **options):
+        self.min_interval = 1 / options["rate_limit"] if options["rate_limit"] else 0
+        self.last_sent_at = None
+        batch_size = max(options["batch_size"], 1)
+        # e.g. emails left after lowering EMAIL_QUEUE_MAX_ATTEMPTS
+        QueuedEmail.objects.given_up().delete()
+        emails = self.claim_emails(batch_size)
+        if not emails:
+            return
+        # all emails are sent through a single connection, which is only opened if there is something to send
+        with get_connection() as connection:
+            while emails:
+                self.send_emails(connection, emails)
+                emails = self.claim_emails(batch_size)
+
+    def send_emails(self, connection, emails):
+        sent_email_ids, failed_emails, given_up_email_ids = [], [], []
+        try:
+            for email in emails:
+                self.wait_for_rate_limit()
+                try:
+                    connection.send_messages([email.to_message()])
+                    sent_email_ids.append(email.pk)
+                except Exception as e:
+                    email.defer(e, now())
+                    if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+                        # the content is not kept, as it might contain passwords
+                        logger.error(f"Giving up sending email {email.pk} to {email.to} ({e})")
+                        given_up_email_ids.append(email.pk)
+                    else:
+                        logger.warning(f"Sending email {email.pk} failed ({e})")
+                        failed_emails.append(email)
+                    reopen_connection(connection)
+        finally:
+            # emails which weren't attempted are sent after the lease expired
+            QueuedEmail.objects.filter(pk__in=sent_email_ids + given_up_email_ids).delete()
+            QueuedEmail.objects.bulk_update(failed_emails, ["attempts", "last_error", "next_attempt_on"])
+
+    def claim_emails(self, batch_size):
+        """
+        Take a batch of emails from the queue. They are leased by moving their next attempt into the future, so they are
+        not locked while being sent and concurrent runs don't send them again.
+        """
+        with transaction.atomic():
+            emails = list(QueuedEmail.objects.due(now()).select_for_update(skip_locked=True)[:batch_size])
+            QueuedEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_on=now() + timedelta(seconds=settings.EMAIL_QUEUE_LEASE_SECONDS)
+            )
+        return emails
+
+    def wait_for_rate_limit(self):
+        if self.last_sent_at is not None:
+            delay = self.last_sent_at + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.last_sent_at = time.monotonic()
@@ -0,0 +1,185 @@
+"""
+Imports capsules in batches, e.g. when migrating existing customers. Each capsule is given as an object like this (all
+fields besides owner and name are optional):
+
+    {
+        "owner": "<email address of an existing user>",
+        "name": "...",
+        "description": "...",
+        "contents": [{"metadata": "<base64>", "data": "<base64>"}],
+        "recipients": [{"email": "...", "name": "...", "is_email_confirmed": false}],
+        "trustees": [{"email": "...", "name": "...", "partial_key_hash": "<hex>"}],
+        "keyslots": [{"purpose": "pwd", "data": "<base64>", "recipient": "<email address of one of the recipients>"}]
+    }
+
+The file either contains a list of capsules (JSON) or one capsule per line (NDJSON, which is read line by line).
+Recipients are imported without sending confirmation emails. The recipient of a keyslot is optional. Each batch of
+capsules is imported in a transaction of its own.
+"""
+
+from base64 import b64decode
+import binascii
+from itertools import chain, islice
+import json
+import sys
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from memoorje.models import Capsule, CapsuleContent, CapsuleRecipient, Keyslot, Trustee, User
+
+
+class Command(BaseCommand):
+    help = "Imports capsules along with their contents, recipients, trustees and keyslots from a JSON or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="JSON or NDJSON file containing the capsules (- for stdin)")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.CAPSULE_IMPORT_BATCH_SIZE,
+            help="Number of capsules imported at once",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options["batch_size"], 1)
+        imported_count = 0
+        with self.open(options["file"]) as f:
+            records = enumerate(self.read_records(f), start=1)
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                try:
+                    self.import_capsules(batch)
+                except CommandError as e:
+                    raise CommandError(f"{e} ({imported_count} capsules were imported before.)")
+                imported_count += len(batch)
+        self.stdout.write(f"Imported {imported_count} capsules.")
+
+    def open(self, path):
+        if path == "-":
+            return open(sys.stdin.fileno(), encoding="utf-8", closefd=False)
+        try:
+            return open(path, encoding="utf-8")
+        except OSError as e:
+            raise CommandError(f"Cannot open {path}: {e}")
+
+    def read_records(self, f):
+        """The capsule records of a JSON list or NDJSON file."""
+        first_line = f.readline()
+        try:
+            if first_line.lstrip().startswith("["):
+                yield from json.loads(first_line + f.read())
+            else:
+                for line in chain([first_line], f):
+                    if line.strip():
+                        yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise CommandError(f"Invalid JSON: {e}")
+
+    def import_capsules(self, batch):
+        owner_ids = dict(
+            User.objects.filter(email__in=[record.get("owner") for _, record in batch]).values_list("email", "pk")
+        )
+        capsules = []
+        contents = []
+        recipients = []
+        trustees = []
+        keyslots = []
+        for number, record in batch:
+            if record.get("owner") not in owner_ids:
+                raise CommandError(f"Capsule {number}: unknown owner {record.get('owner')!r}.")
+            try:
+                capsule = Capsule(
+                    owner_id=owner_ids[record["owner"]],
+                    name=record["name"],
+                    description=record.get("description", ""),
+                )
+                capsules.append(capsule)
+                # the data files are written when the capsules are saved
+                contents.extend(
+                    (
+                        CapsuleContent(capsule=capsule, metadata=b64decode(content["metadata"])),
+                        b64decode(content["data"]),
+                    )
+                    for content in record.get("contents", [])
+                )
+                capsule_recipients = {
+                    recipient["email"]: CapsuleRecipient(
+                        capsule=capsule,
+                        email=recipient["email"],
+                        name=recipient.get("name", ""),
+                        is_email_confirmed=recipient.get("is_email_confirmed", False),
+                    )
+                    for recipient in record.get("recipients", [])
+                }
+                if len(capsule_recipients) < len(record.get("recipients", [])):
+                    raise CommandError(f"Capsule {number}: duplicate recipients.")
+                recipients.extend(capsule_recipients.values())
+                trustees.extend(
+                    Trustee(
+                        capsule=capsule,
+                        email=trustee.get("email", ""),
+                        name=trustee.get("name", ""),
+                        partial_key_hash=bytes.fromhex(trustee["partial_key_hash"]),
+                    )
+                    for trustee in record.get("trustees", [])
+                )
+                for keyslot in record.get("keyslots", []):
+                    recipient_email = keyslot.get("recipient")
+                    if recipient_email is not None and recipient_email not in capsule_recipients:
+                        raise CommandError(f"Capsule {number}: unknown keyslot recipient {recipient_email!r}.")
+                    # the recipients get their ids when they are saved
+                    keyslots.append(
+                        (
+                            Keyslot(
+                                capsule=capsule,
+                                data=b64decode(keyslot["data"]),
+                                purpose=Keyslot.Purpose(keyslot["purpose"]),
+                            ),
+                            capsule_recipients.get(recipient_email),
+                        )
+                    )
+            except KeyError as e:
+                raise CommandError(f"Capsule {number}: missing field {e}.")
+            except (binascii.Error, TypeError, ValueError) as e:
+                raise CommandError(f"Capsule {number}: invalid value ({e}).")
+        try:
+            self.save_capsules(capsules, contents, recipients, trustees, keyslots)
+        except IntegrityError as e:
+            raise CommandError(f"Capsules {batch[0][0]} to {batch[-1][0]}: {e}")
+
+    def save_capsules(self, capsules, contents, recipients, trustees, keyslots):
+        storage = CapsuleContent._meta.get_field("data").storage
+        data_names = []
+        try:
+            with transaction.atomic():
+                Capsule.objects.bulk_create(capsules)
+                for content, data in contents:
+                    content.data = storage.save("data", ContentFile(data))
+                    data_names.append(content.data.name)
+                CapsuleContent.objects.bulk_create(content for content, _ in contents)
+                CapsuleRecipient.objects.bulk_create(recipients)
+                Trustee.objects.bulk_create(trustees)
+                if any(recipient is not None and recipient.pk is None for _, recipient in keyslots):
+                    # not every database returns the ids of bulk created rows
+                    recipient_ids = {
+                        (capsule_id, email): pk
+                        for capsule_id, email, pk in CapsuleRecipient.objects.filter(capsule__in=capsules).values_list(
+                            "capsule", "email", "pk"
+                        )
+                    }
+                    for recipient in recipients:
+                        recipient.pk = recipient_ids[(recipient.capsule_id, recipient.email)]
+                for keyslot, recipient in keyslots:
+                    keyslot.recipient = recipient
+                Keyslot.objects.bulk_create(keyslot for keyslot, _ in keyslots)
+        except Exception:
+            # shared files might have existed before
+            if not storage.is_shared:
+                for name in data_names:
+                    storage.delete(name)
+            raise
@@ -1,11 +1,16 @@
-from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 import logging
+import time
 
+import django
 from django.conf import settings
 from django.core.management import BaseCommand
+from django.db import transaction
 from django.utils.timezone import now
 
-from memoorje.crypto import RecryptError
+from memoorje.crypto import combine_partial_key_sets, RecryptError
+from memoorje.emails import CapsuleRecipientReleaseNotificationEmail, send_templated_emails
 from memoorje.models import Capsule
 
 logger = logging.getLogger(__name__)
@@ -14,22 +19,83 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = "Sends notifications to capsule recipients when the capsule was released"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.CAPSULE_RELEASE_WORKERS,
+            help="Number of processes used for encrypting the recipient keyslots (default: number of CPUs)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.CAPSULE_RELEASE_BATCH_SIZE,
+            help="Number of capsules whose keyslots are encrypted concurrently",
+        )
+
     def handle(self, *args, **options):
-        for capsule in Capsule.objects.filter(partial_keys__isnull=False, is_released=False).distinct():
-            has_grace_period_elapsed = now() >= (
-                capsule.partial_keys.order_by("created_on").first().created_on
-                + timedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS)
-            )
-            if has_grace_period_elapsed:
-                try:
-                    passwords = capsule.release()
-                    if passwords is not None:
-                        # send passwords to recipients
-                        for recipient, password in passwords.items():
-                            recipient.send_release_notification(password)
-                        # remove partial keys
-                        capsule.partial_keys.all().delete()
-                except RecryptError as e:
-                    logger.info(
-                        f"Capsule {capsule.pk} is not released yet and has partial keys but releasing failed ({e})"
+        capsules = list(Capsule.objects.due_for_release(now()))
+        batch_size = max(options["batch_size"], 1)
+        with self.get_executor(options["workers"]) as executor:
+            for start in range(0, len(capsules), batch_size):
+                self.release_capsules(capsules[start : start + batch_size], executor)
+
+    def get_executor(self, workers):
+        if workers is not None and workers <= 1:
+            # encrypt in this process
+            return nullcontext()
+        # django.setup() allows workers to import memoorje.crypto if they are not forked
+        return ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+
+    def release_capsules(self, capsules, executor):
+        # The partial keys of all capsules of the batch are combined at once (in parallel by the worker pool backend).
+        sss_passwords = combine_partial_key_sets(capsule.partial_keys.all() for capsule in capsules)
+        # Start the keyslot encryption for all capsules of the batch first, so that the workers are kept busy.
+        prepared = []
+        for capsule, sss_password in zip(capsules, sss_passwords):
+            started_at = time.monotonic()
+            try:
+                if isinstance(sss_password, RecryptError):
+                    raise sss_password
+                pending_keyslots = capsule.prepare_release(executor, sss_password)
+            except RecryptError as e:
+                logger.info(f"Capsule {capsule.pk} is not released yet and has partial keys but releasing failed ({e})")
+                continue
+            except Exception:
+                # e.g. a broken process pool, the other capsules may still be released
+                logger.exception(f"Releasing capsule {capsule.pk} failed")
+                continue
+            if pending_keyslots is not None:
+                prepared.append((capsule, pending_keyslots, started_at))
+
+        for capsule, pending_keyslots, started_at in prepared:
+            try:
+                with transaction.atomic():
+                    # waits for the keyslot encryption, which might have failed
+                    passwords = capsule.complete_release(pending_keyslots)
+                    # remove partial keys
+                    capsule.partial_keys.all().delete()
+            except Exception:
+                logger.exception(f"Releasing capsule {capsule.pk} failed")
+                continue
+            # The passwords are sent once the release is committed. Otherwise, a refused email would roll back the
+            # keyslots whose passwords were already sent to other recipients.
+            sent = send_templated_emails(
+                (
+                    (
+                        CapsuleRecipientReleaseNotificationEmail(recipient.email),
+                        {"instance": recipient, "password": password},
                     )
+                    for recipient, password in passwords.items()
+                ),
+                fail_silently=True,
+            )
+            if not all(sent):
+                logger.error(
+                    f"Capsule {capsule.pk} was released but {sent.count(False)} of {len(sent)} recipients could not be "
+                    f"notified"
+                )
+            logger.info(
+                f"Capsule {capsule.pk} was released for {len(passwords)} recipients "
+                f"in {time.monotonic() - started_at:.2f}s"
+            )
@@ -1,23 +1,27 @@
-from datetime import timedelta
+from itertools import groupby
 
 from django.conf import settings
 from django.core.management import BaseCommand
-from django.utils.timezone import now
 
-from memoorje.models import Capsule
+from memoorje.emails import CapsuleHintsEmail, send_templated_emails
+from memoorje.models import CapsuleRecipient
 
 
 class Command(BaseCommand):
     help = "Sends hints about a capsule to the owner"
 
     def handle(self, *args, **options):
-        def recipient_is_inactive(recipient):
-            return not recipient.is_active() and (
-                (now() - recipient.created_on) >= timedelta(days=settings.INACTIVE_RECIPIENT_HINT_DAYS)
+        # send hints for capsules with inactive recipients
+        inactive_recipients = (
+            CapsuleRecipient.objects.inactive_older_than(settings.INACTIVE_RECIPIENT_HINT_DAYS)
+            .select_related("capsule__owner")
+            .order_by("capsule_id", "pk")
+        )
+        emails = []
+        for _, recipients in groupby(inactive_recipients, key=lambda recipient: recipient.capsule_id):
+            recipients = list(recipients)
+            capsule = recipients[0].capsule
+            emails.append(
+                (CapsuleHintsEmail(capsule.owner.email), {"instance": capsule, "inactive_recipients": recipients})
             )
-
-        for capsule in Capsule.objects.all():
-            # send hints for capsules with inactive recipients
-            inactive_recipients = [r for r in capsule.recipients.all() if recipient_is_inactive(r)]
-            if len(inactive_recipients) > 0:
-                capsule.send_hints(inactive_recipients=inactive_recipients)
+        send_templated_emails(emails, fail_silently=True)
@@ -4,21 +4,26 @@ from django.conf import settings
 from django.core.management import BaseCommand
 from django.utils.timezone import now
 
-from memoorje.models import User
+from memoorje.emails import JournalNotificationEmail, send_templated_emails
+from memoorje.models import JournalEntry, User
 
 
 class Command(BaseCommand):
     help = "Sends a notification about new journal entries to user"
 
     def handle(self, *args, **options):
-        for user in User.objects.all():
-            journal_entries = user.journal_entries.order_by("created_on").filter(
-                created_on__lte=now() - timedelta(minutes=settings.JOURNAL_NOTIFICATION_GRACE_PERIOD_MINUTES)
-            )
-            if user.latest_notified_journal_entry is not None:
-                journal_entries = journal_entries.filter(created_on__gt=user.latest_notified_journal_entry.created_on)
-            latest_entry = journal_entries.last()
-            if latest_entry is not None:
-                user.send_journal_notification()
-                user.latest_notified_journal_entry = latest_entry
-                user.save()
+        until = now() - timedelta(minutes=settings.JOURNAL_NOTIFICATION_GRACE_PERIOD_MINUTES)
+        latest_entry_ids = {
+            row["user"]: row["latest_entry_id"] for row in JournalEntry.objects.latest_unnotified_per_user(until)
+        }
+        if not latest_entry_ids:
+            return
+        users = list(User.objects.filter(pk__in=latest_entry_ids))
+        # users whose notification could not be sent are notified again on the next run
+        sent = send_templated_emails(
+            ((JournalNotificationEmail(user.email), {"instance": user}) for user in users), fail_silently=True
+        )
+        notified_users = [user for user, is_sent in zip(users, sent) if is_sent]
+        for user in notified_users:
+            user.latest_notified_journal_entry_id = latest_entry_ids[user.pk]
+        User.objects.bulk_update(notified_users, ["latest_notified_journal_entry"])
@@ -1,9 +1,7 @@
-from datetime import timedelta
-
-from django.conf import settings
 from django.core.management import BaseCommand
 from django.utils.timezone import now
 
+from memoorje.emails import send_templated_emails, TrusteePartialKeyInvitationEmail
 from memoorje.models import Capsule
 
 
@@ -11,13 +9,16 @@ class Command(BaseCommand):
     help = "Sends invitations for providing partial keys to trustees"
 
     def handle(self, *args, **options):
-        for capsule in Capsule.objects.filter(is_released=False):
-            first_key = capsule.partial_keys.order_by("created_on").first()
-            if (
-                first_key is not None
-                and not capsule.are_partial_key_invitations_sent
-                and (first_key.created_on < (now() - timedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS)))
-            ):
-                for trustee in capsule.trustees.all():
-                    trustee.send_partial_key_invitation()
-                Capsule.objects.update(id=capsule.id, are_partial_key_invitations_sent=True)
+        capsules = list(Capsule.objects.due_for_partial_key_invitations(now()))
+        if not capsules:
+            return
+        trustees = [trustee for capsule in capsules for trustee in capsule.trustees.all() if trustee.email]
+        sent = send_templated_emails(
+            ((TrusteePartialKeyInvitationEmail(trustee.email), {"instance": trustee}) for trustee in trustees),
+            fail_silently=True,
+        )
+        # the invitations of a capsule are sent again on the next run unless all of them were sent
+        failed_capsule_ids = {trustee.capsule_id for trustee, is_sent in zip(trustees, sent) if not is_sent}
+        Capsule.objects.filter(
+            id__in=[capsule.id for capsule in capsules if capsule.id not in failed_capsule_ids]
+        ).update(are_partial_key_invitations_sent=True)
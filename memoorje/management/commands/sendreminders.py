@@ -1,24 +1,40 @@
 from datetime import date
 
-from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.core.management import BaseCommand
 
-from memoorje.models import Capsule, User
+from memoorje.emails import ReminderEmail, send_templated_emails
+from memoorje.models import User
 
 
 class Command(BaseCommand):
     help = "Sends reminders to users with elapsed remind interval"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.REMINDER_BATCH_SIZE,
+            help="Number of reminders sent at once",
+        )
+
     def handle(self, *args, **options):
-        for user in User.objects.all():
-            # send reminders only to users owning at least one capsule
-            if user.capsules.exists():
-                remind_interval = relativedelta(months=user.remind_interval)
-                if user.last_reminder_sent_on is None:
-                    # the first reminder is sent relative to the creation of the oldest capsule
-                    oldest_capsule: Capsule = user.capsules.order_by("created_on").first()
-                    if date.today() >= (oldest_capsule.created_on.date() + remind_interval):
-                        user.send_reminder()
-                elif date.today() >= (user.last_reminder_sent_on + remind_interval):
-                    # further reminders are sent according to the interval set
-                    user.send_reminder()
+        today = date.today()
+        batch_size = max(options["batch_size"], 1)
+        # the reminder template lists the capsules of the user
+        users = User.objects.due_for_reminder(today).prefetch_related("capsules").order_by("pk")
+        last_pk = None
+        while True:
+            batch = users if last_pk is None else users.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            # users whose reminder could not be sent are reminded again on the next run
+            sent = send_templated_emails(
+                ((ReminderEmail(user.email), {"instance": user}) for user in batch), fail_silently=True
+            )
+            reminded_users = [user for user, is_sent in zip(batch, sent) if is_sent]
+            for user in reminded_users:
+                user.last_reminder_sent_on = today
+            User.objects.bulk_update(reminded_users, ["last_reminder_sent_on"])
+            last_pk = batch[-1].pk
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memoorje', '0039_user_language'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('from_email', models.CharField(blank=True, max_length=254)),
+                ('to', models.EmailField(max_length=254)),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+                ('html_body', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='queuedemail',
+            index=models.Index(fields=['next_attempt_on'], name='memoorje_qu_next_at_698d2e_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memoorje', '0040_queuedemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['user', 'created_on'], name='memoorje_jo_user_id_c1cd4f_idx'),
+        ),
+    ]
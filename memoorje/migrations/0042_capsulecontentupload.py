@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memoorje', '0041_journalentry_user_created_on_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapsuleContentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('metadata', models.BinaryField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('sha256', models.BinaryField(max_length=32)),
+                ('received_size', models.PositiveBigIntegerField(default=0)),
+                ('file_name', models.CharField(editable=False, max_length=255)),
+                ('capsule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='content_uploads', to='memoorje.capsule')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memoorje', '0042_capsulecontentupload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='capsulecontent',
+            index=models.Index(fields=['data'], name='memoorje_ca_data_2c107b_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memoorje', '0043_capsulecontent_data_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='capsule',
+            index=models.Index(fields=['owner', 'id'], name='memoorje_ca_owner_i_ee95f7_idx'),
+        ),
+    ]
@@ -1,15 +1,20 @@
-from datetime import date
+from concurrent.futures import Executor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 import hashlib
-from typing import Mapping, Optional
+from typing import BinaryIO, List, Mapping, Optional, TYPE_CHECKING
 import uuid
 
+from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.db import models, transaction
+from django.db.models import F, Max, Min, Prefetch, Q
+from django.db.models.functions import Coalesce, TruncDate
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from djeveric.fields import ConfirmationField
@@ -18,20 +23,46 @@ from memoorje_crypto.formats import EncryptionV1
 
 from memoorje.data_storage.fields import CapsuleDataField
 from memoorje.emails import (
-    CapsuleHintsEmail,
     CapsuleRecipientConfirmationEmail,
-    CapsuleRecipientReleaseNotificationEmail,
-    JournalNotificationEmail,
     ReleaseInitiatedNotificationEmail,
-    ReminderEmail,
-    TrusteePartialKeyInvitationEmail,
     UserRegistrationConfirmationEmail,
     UserResetPasswordEmail,
 )
 from memoorje.tokens import CapsuleRecipientTokenGeneratorProxy
 
+if TYPE_CHECKING:
+    from memoorje.crypto import PendingKeyslots
 
-class UserManager(BaseUserManager):
+
+class UserQuerySet(models.QuerySet):
+    def due_for_reminder(self, today: date):
+        """
+        Users owning at least one capsule whose remind interval has elapsed today. The interval starts with the last
+        reminder or, if no reminder was sent yet, with the creation of the oldest capsule.
+        """
+        intervals = self.order_by().values_list("remind_interval", flat=True).distinct()
+        is_due = Q(pk__in=[])
+        for interval in intervals:
+            is_due |= Q(remind_interval=interval, reminder_start_date__lte=_get_latest_due_start_date(today, interval))
+        return self.annotate(
+            first_capsule_created_on=Min("capsules__created_on"),
+            reminder_start_date=Coalesce(
+                "last_reminder_sent_on", TruncDate("first_capsule_created_on", tzinfo=dt_timezone.utc)
+            ),
+        ).filter(is_due, first_capsule_created_on__isnull=False)
+
+
+def _get_latest_due_start_date(today: date, interval_months: int) -> date:
+    """The latest start date for which `start_date + interval_months` has been reached today."""
+    interval = relativedelta(months=interval_months)
+    start_date = today - interval
+    # adding months isn't reversible at the end of months (e.g. Aug 31st + 6 months = Feb 28th)
+    while start_date + timedelta(days=1) + interval <= today:
+        start_date += timedelta(days=1)
+    return start_date
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     use_in_migrations = True
 
     def _create_user(self, email, password, **extra_fields):
@@ -104,20 +135,10 @@ class User(PermissionsMixin, AbstractBaseUser):
         """Send an email to this user."""
         email_class(self.email).send(**kwargs)
 
-    def send_journal_notification(self):
-        """Send a notification on new journal entries to this user."""
-        self.send_email(JournalNotificationEmail)
-
     def send_registration_confirmation(self):
         """Send a confirmation email to this user."""
         self.send_email(UserRegistrationConfirmationEmail, instance=self)
 
-    def send_reminder(self):
-        """Send a reminder to this user."""
-        self.send_email(ReminderEmail, instance=self)
-        self.last_reminder_sent_on = date.today()
-        self.save()
-
     def send_reset_password_email(self):
         """Send an email with a link to reset the user's password."""
         self.send_email(UserResetPasswordEmail, instance=self)
@@ -136,13 +157,97 @@ class CapsuleContent(models.Model):
     metadata = models.BinaryField()
     data = CapsuleDataField()
 
+    class Meta:
+        # allows to find all contents sharing a file (see CAPSULE_DATA_STORAGE)
+        indexes = [models.Index(fields=["data"])]
+
+
+class CapsuleContentUploadError(Exception):
+    pass
+
+
+class CapsuleContentUploadQuerySet(models.QuerySet):
+    def expired(self, now: datetime):
+        """Uploads which were not completed within CAPSULE_CONTENT_UPLOAD_EXPIRY_DAYS."""
+        return self.filter(created_on__lte=now - timedelta(days=settings.CAPSULE_CONTENT_UPLOAD_EXPIRY_DAYS))
+
+
+class CapsuleContentUpload(models.Model):
+    """
+    A capsule content whose data is uploaded in chunks. The chunks are appended to a file in the capsule data storage,
+    which becomes the data of the capsule content once the upload is completed.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    capsule = models.ForeignKey("Capsule", on_delete=models.CASCADE, related_name="content_uploads")
+    created_on = models.DateTimeField(auto_now_add=True)
+    metadata = models.BinaryField()
+    # the expected size and SHA-256 hash of the data
+    size = models.PositiveBigIntegerField()
+    sha256 = models.BinaryField(max_length=32)
+    received_size = models.PositiveBigIntegerField(default=0)
+    file_name = models.CharField(max_length=255, editable=False)
+
+    objects = models.Manager.from_queryset(CapsuleContentUploadQuerySet)()
+
+    @property
+    def storage(self):
+        return CapsuleContent._meta.get_field("data").storage
+
+    def save(self, *args, **kwargs):
+        if not self.file_name:
+            self.file_name = self.storage.create_upload_file()
+        super().save(*args, **kwargs)
+
+    def append(self, offset: int, stream: BinaryIO):
+        """
+        Append a chunk of data read from the stream. The chunk must start where the data received so far ends.
+
+        :raise CapsuleContentUploadError: If the offset is wrong or the data exceeds the expected size.
+        """
+        if offset != self.received_size:
+            raise CapsuleContentUploadError(f"Chunk must start at offset {self.received_size}.")
+        with open(self.storage.path(self.file_name), "r+b") as f:
+            # discard anything written by interrupted requests
+            f.truncate(offset)
+            f.seek(offset)
+            while chunk := stream.read(settings.CAPSULE_CONTENT_UPLOAD_BUFFER_SIZE):
+                offset += len(chunk)
+                if offset > self.size:
+                    raise CapsuleContentUploadError(f"Data exceeds the expected size of {self.size} bytes.")
+                f.write(chunk)
+        self.received_size = offset
+        self.save(update_fields=["received_size"])
+
+    def complete(self) -> CapsuleContent:
+        """
+        Create the capsule content with the uploaded data and remove this upload.
+
+        :raise CapsuleContentUploadError: If the data is incomplete or its hash doesn't match.
+        """
+        if self.received_size != self.size:
+            raise CapsuleContentUploadError(f"Only {self.received_size} of {self.size} bytes were received.")
+        data_hash = hashlib.sha256()
+        with self.storage.open(self.file_name, "rb") as f:
+            while chunk := f.read(settings.CAPSULE_CONTENT_UPLOAD_BUFFER_SIZE):
+                data_hash.update(chunk)
+        if data_hash.digest() != bytes(self.sha256):
+            raise CapsuleContentUploadError("The SHA-256 hash of the received data does not match.")
+        with transaction.atomic():
+            data_name = self.storage.complete_upload_file(self.file_name, data_hash.digest())
+            content = CapsuleContent.objects.create(capsule=self.capsule, metadata=self.metadata, data=data_name)
+            # the file now belongs to the content and must not be deleted along with the upload
+            self.file_name = ""
+            self.delete()
+        return content
+
 
 class CapsuleRecipientQuerySet(models.QuerySet):
     def get_by_token(self, token: str):
         if token is not None:
             pk, *_ = token.partition("-")
             try:
-                recipient: CapsuleRecipient = self.get(pk=int(pk))
+                recipient: CapsuleRecipient = self.select_related("capsule").get(pk=int(pk))
                 if recipient.recipient_token_generator_proxy.check_token(token):
                     return recipient
                 else:
@@ -151,6 +256,10 @@ class CapsuleRecipientQuerySet(models.QuerySet):
                 raise CapsuleRecipient.DoesNotExist(f"Invalid pk: {pk}.")
         raise CapsuleRecipient.DoesNotExist("No recipient found for None token.")
 
+    def inactive_older_than(self, days: int):
+        """Recipients which did not confirm their email address within the given number of days."""
+        return self.filter(is_email_confirmed=False, created_on__lte=timezone.now() - timedelta(days=days))
+
 
 class CapsuleRecipient(ConfirmableModelMixin, models.Model):
     capsule = models.ForeignKey("Capsule", on_delete=models.CASCADE, related_name="recipients")
@@ -171,10 +280,6 @@ class CapsuleRecipient(ConfirmableModelMixin, models.Model):
     def is_active(self) -> bool:
         return self.is_email_confirmed
 
-    def send_release_notification(self, password):
-        """Send a capsule release notification to this recipient."""
-        CapsuleRecipientReleaseNotificationEmail(self.email).send(instance=self, password=password)
-
 
 class Keyslot(models.Model):
     class Purpose(models.TextChoices):
@@ -213,9 +318,48 @@ class Trustee(models.Model):
     class Meta:
         unique_together = ["capsule", "partial_key_hash"]
 
-    def send_partial_key_invitation(self):
-        if self.email:
-            TrusteePartialKeyInvitationEmail(self.email).send(instance=self)
+
+class CapsuleQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for capsule in objs:
+            capsule.set_recursive_relation()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def due_for_release(self, now: datetime):
+        """
+        Capsules which are not released yet and whose first partial key was created at least a grace period ago.
+
+        Everything needed for releasing the capsules is fetched along with them.
+        """
+        grace_period = timedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS)
+        return (
+            self.filter(is_released=False)
+            .annotate(first_partial_key_created_on=Min("partial_keys__created_on"))
+            .filter(first_partial_key_created_on__lte=now - grace_period)
+            .select_related("owner")
+            .prefetch_related(
+                "partial_keys",
+                "recipients",
+                Prefetch("keyslots", queryset=Keyslot.objects.filter(purpose=Keyslot.Purpose.SSS)),
+            )
+        )
+
+    def due_for_partial_key_invitations(self, now: datetime):
+        """
+        Capsules which are not released yet, whose first partial key was created more than a grace period ago and whose
+        trustees were not invited to provide their partial keys yet.
+
+        The trustees are fetched along with the capsules.
+        """
+        grace_period = timedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS)
+        return (
+            self.filter(is_released=False, are_partial_key_invitations_sent=False)
+            .annotate(first_partial_key_created_on=Min("partial_keys__created_on"))
+            .filter(first_partial_key_created_on__lt=now - grace_period)
+            .select_related("owner")
+            .prefetch_related("trustees")
+        )
 
 
 class Capsule(models.Model):
@@ -232,33 +376,70 @@ class Capsule(models.Model):
     # "capsule related" models (e.g. in views).
     capsule = models.ForeignKey("self", on_delete=models.CASCADE, null=True, related_name="+")
 
-    def touch(self, timestamp=timezone.now()):
-        self.updated_on = timestamp
-        self.save()
+    objects = models.Manager.from_queryset(CapsuleQuerySet)()
 
-    def release(self) -> Optional[Mapping[CapsuleRecipient, str]]:
+    class Meta:
+        # the ids of a user's capsules are looked up by the visibility filters (see OwnedCapsuleRelatedFilterMixin)
+        indexes = [models.Index(fields=["owner", "id"])]
+
+    def save(self, *args, **kwargs):
+        self.set_recursive_relation()
+        super().save(*args, **kwargs)
+
+    def set_recursive_relation(self):
+        # the id is generated before inserting, so the capsule is written only once
+        if self.capsule_id is None:
+            self.capsule_id = self.id
+
+    def touch(self, timestamp: Optional[datetime] = None):
+        self.updated_on = timestamp or timezone.now()
+        self.save(update_fields=["updated_on"])
+
+    def prepare_release(
+        self, executor: Optional[Executor] = None, sss_password: Optional[bytes] = None
+    ) -> Optional["PendingKeyslots"]:
         """
-        Try to release this capsule. "Releasing" means combining all existing partial keys, decrypting the secret and
-        re-encrypting it with a new password.
+        Prepare the release of this capsule: combine all existing partial keys, decrypt the secret and start
+        re-encrypting it for each recipient (using the given executor, if any).
 
         Releasing the capsule is only tried if the capsule was not already released and at least one partial key exists.
 
-        :return: A newly created password for each recipient of this capsule. None otherwise.
+        :param sss_password: The combined partial keys, if they were already combined.
+        :return: The pending recipient keyslots if the capsule can be released. None otherwise.
         """
-        from memoorje.crypto import recrypt_capsule
+        from memoorje.crypto import start_recrypt
 
         if not self.is_released:
-            partial_keys = self.partial_keys.all()
-            if partial_keys.exists():
-                passwords = recrypt_capsule(self, partial_keys)
-                # We prevent Capsule.updated_on from being touched when setting the is_released flag.
-                Capsule.objects.filter(id=self.id).update(is_released=True)
-                return passwords
+            partial_keys = list(self.partial_keys.all())
+            if partial_keys:
+                return start_recrypt(self, partial_keys, executor, sss_password)
         return None
 
-    def send_hints(self, inactive_recipients=None):
-        """Send hints regarding notable facts to capsule owner."""
-        self.owner.send_email(CapsuleHintsEmail, instance=self, inactive_recipients=inactive_recipients)
+    def complete_release(self, pending_keyslots: "PendingKeyslots") -> Mapping[CapsuleRecipient, str]:
+        """
+        Store the keyslots created by prepare_release() and mark this capsule as released (in a single transaction).
+
+        :return: A newly created password for each recipient of this capsule.
+        """
+        with transaction.atomic():
+            passwords = pending_keyslots.create()
+            # We prevent Capsule.updated_on from being touched when setting the is_released flag.
+            Capsule.objects.filter(id=self.id).update(is_released=True)
+        return passwords
+
+    def release(self, executor: Optional[Executor] = None) -> Optional[Mapping[CapsuleRecipient, str]]:
+        """
+        Try to release this capsule. "Releasing" means combining all existing partial keys, decrypting the secret and
+        re-encrypting it with a new password.
+
+        Releasing the capsule is only tried if the capsule was not already released and at least one partial key exists.
+
+        :return: A newly created password for each recipient of this capsule. None otherwise.
+        """
+        pending_keyslots = self.prepare_release(executor)
+        if pending_keyslots is not None:
+            return self.complete_release(pending_keyslots)
+        return None
 
     def send_notification(self, release_initiated=False):
         """Send a notification email to the capsule owner."""
@@ -266,6 +447,24 @@ class Capsule(models.Model):
             self.owner.send_email(ReleaseInitiatedNotificationEmail, instance=self)
 
 
+class JournalEntryQuerySet(models.QuerySet):
+    def latest_unnotified_per_user(self, until: datetime):
+        """
+        The id of the latest journal entry created until the given time (as `latest_entry_id`) per user (as `user`).
+        Only users with entries newer than their latest notified journal entry are included.
+        """
+        return (
+            self.filter(created_on__lte=until)
+            .filter(
+                Q(user__latest_notified_journal_entry__isnull=True)
+                | Q(created_on__gt=F("user__latest_notified_journal_entry__created_on"))
+            )
+            .order_by()
+            .values("user")
+            .annotate(latest_entry_id=Max("id"))
+        )
+
+
 class JournalEntry(models.Model):
     class Action(models.TextChoices):
         CREATE = "c"
@@ -279,3 +478,70 @@ class JournalEntry(models.Model):
     entity = GenericForeignKey("entity_type", "entity_id")
     entity_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     entity_id = models.PositiveIntegerField()
+
+    objects = models.Manager.from_queryset(JournalEntryQuerySet)()
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "created_on"])]
+
+
+class QueuedEmailQuerySet(models.QuerySet):
+    def due(self, now: datetime):
+        """Emails which should be (re-)tried to be sent now."""
+        return self.filter(attempts__lt=settings.EMAIL_QUEUE_MAX_ATTEMPTS, next_attempt_on__lte=now).order_by(
+            "next_attempt_on", "pk"
+        )
+
+    def given_up(self):
+        """Emails which failed too often (see EMAIL_QUEUE_MAX_ATTEMPTS)."""
+        return self.filter(attempts__gte=settings.EMAIL_QUEUE_MAX_ATTEMPTS)
+
+
+class QueuedEmail(models.Model):
+    """
+    An email message waiting to be sent by the flushmailqueue command. Sent messages are deleted, as are messages which
+    failed too often (their content might contain passwords or links for resetting passwords).
+    """
+
+    created_on = models.DateTimeField(auto_now_add=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.EmailField()
+    subject = models.TextField()
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    objects = models.Manager.from_queryset(QueuedEmailQuerySet)()
+
+    class Meta:
+        indexes = [models.Index(fields=["next_attempt_on"])]
+
+    @classmethod
+    def from_message(cls, message: EmailMessage) -> List["QueuedEmail"]:
+        html_bodies = [content for content, mimetype in getattr(message, "alternatives", []) if mimetype == "text/html"]
+        return [
+            cls(
+                from_email=message.from_email or "",
+                to=to,
+                subject=message.subject,
+                body=message.body,
+                html_body=html_bodies[0] if html_bodies else "",
+            )
+            for to in message.to
+        ]
+
+    def to_message(self) -> EmailMessage:
+        message = EmailMultiAlternatives(self.subject, self.body, self.from_email or None, [self.to])
+        if self.html_body:
+            message.attach_alternative(self.html_body, "text/html")
+        return message
+
+    def defer(self, error: Exception, now: datetime):
+        """Record a failed attempt and schedule the next one with an exponential backoff."""
+        self.attempts += 1
+        self.last_error = str(error)
+        self.next_attempt_on = now + timedelta(
+            seconds=settings.EMAIL_QUEUE_RETRY_DELAY_SECONDS * 2 ** (self.attempts - 1)
+        )
@@ -1,12 +1,16 @@
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, SAFE_METHODS
 
 
+def is_own_capsule(request, capsule) -> bool:
+    # comparing the ids avoids loading the owner
+    return capsule.owner_id == request.user.pk
+
+
 class IsCapsuleOwner(IsAuthenticated):
     def has_object_permission(self, request, view, obj):
         try:
             capsule = obj.capsule
-            is_own_capsule = capsule.owner == request.user
-            return is_own_capsule
+            return is_own_capsule(request, capsule)
         except AttributeError:
             return False
 
@@ -22,7 +26,6 @@ class IsCapsuleOwnerOrReadOnly(IsAuthenticatedOrReadOnly):
         try:
             capsule = obj.capsule
             is_read_only = request.method in SAFE_METHODS
-            is_own_capsule = capsule.owner == request.user
-            return is_read_only or is_own_capsule
+            return is_read_only or is_own_capsule(request, capsule)
         except AttributeError:
             return False
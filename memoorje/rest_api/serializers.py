@@ -1,6 +1,15 @@
 from rest_framework import serializers
 
-from memoorje.models import Capsule, CapsuleContent, CapsuleRecipient, Keyslot, PartialKey, Trustee, User
+from memoorje.models import (
+    Capsule,
+    CapsuleContent,
+    CapsuleContentUpload,
+    CapsuleRecipient,
+    Keyslot,
+    PartialKey,
+    Trustee,
+    User,
+)
 from memoorje.rest_api.fields import BinaryField, HexDigestField
 from memoorje.utils import get_authenticated_user
 
@@ -34,6 +43,21 @@ class CapsuleContentSerializer(CapsuleRelatedSerializerMixin, serializers.Hyperl
         fields = ["capsule", "data", "data_size_bytes", "id", "metadata", "url"]
 
 
+class CapsuleContentUploadSerializer(CapsuleRelatedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    metadata = BinaryField()
+    sha256 = HexDigestField()
+
+    class Meta:
+        model = CapsuleContentUpload
+        fields = ["capsule", "id", "metadata", "received_size", "sha256", "size", "url"]
+        read_only_fields = ["received_size"]
+
+    def validate_sha256(self, value):
+        if len(value) != 32:
+            raise serializers.ValidationError("Expected a SHA-256 hash.", "invalid_hash")
+        return value
+
+
 class CapsuleRecipientSerializer(CapsuleRelatedSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = CapsuleRecipient
@@ -80,7 +104,9 @@ class TrusteeSerializer(CapsuleRelatedSerializerMixin, serializers.HyperlinkedMo
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
-    account_balance = serializers.DecimalField(max_digits=8, decimal_places=2, source="transactions.get_balance")
+    account_balance = serializers.DecimalField(
+        max_digits=8, decimal_places=2, source="account_balance.amount", read_only=True
+    )
 
     class Meta:
         model = User
@@ -0,0 +1,168 @@
+from datetime import timedelta
+import hashlib
+from io import StringIO
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.core import management
+from django.utils.timezone import now
+from rest_framework import status
+
+from memoorje.models import CapsuleContent, CapsuleContentUpload
+from memoorje.rest_api.tests.utils import MemoorjeAPITestCase, reverse
+from memoorje.rest_api.views import CapsuleContentUploadViewSet
+from memoorje.tests.memoorje import create_test_data_file
+from memoorje.tests.mixins import CapsuleMixin
+
+
+class CapsuleContentUploadTestCase(CapsuleMixin, MemoorjeAPITestCase):
+    data = b"Some encrypted data which is uploaded in chunks"
+    metadata = b"Capsule Content's Metadata"
+
+    def test_upload_capsule_content(self):
+        """
+        Upload the data of a capsule content in chunks.
+        """
+        self.create_upload()
+        for offset in range(0, len(self.data), 10):
+            response = self.put_chunk(offset, self.data[offset : offset + 10])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["received_size"], min(offset + 10, len(self.data)))
+        response = self.complete_upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        capsule_content = CapsuleContent.objects.get()
+        self.assertEqual(response.data["id"], capsule_content.id)
+        self.assertEqual(capsule_content.capsule, self.capsule)
+        self.assertEqual(capsule_content.metadata, self.metadata)
+        self.assertEqual(capsule_content.data.read(), self.data)
+        self.assertFalse(CapsuleContentUpload.objects.exists())
+
+    def test_resume_upload(self):
+        """
+        Resume an upload at the received size after sending a chunk at a wrong offset.
+        """
+        self.create_upload()
+        self.put_chunk(0, self.data[:10])
+        response = self.put_chunk(20, self.data[20:])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.get_api_url("/capsule-content-uploads/{pk}/", pk=self.upload.pk))
+        self.assertEqual(response.data["received_size"], 10)
+        self.put_chunk(10, self.data[10:])
+        response = self.complete_upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(CapsuleContent.objects.get().data.read(), self.data)
+
+    def test_upload_exceeding_size(self):
+        """
+        Try to upload more data than announced.
+        """
+        self.create_upload()
+        response = self.put_chunk(0, self.data + b"more")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.received_size, 0)
+
+    def test_complete_incomplete_upload(self):
+        """
+        Try to complete an upload before all data was sent.
+        """
+        self.create_upload()
+        self.put_chunk(0, self.data[:10])
+        response = self.complete_upload()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CapsuleContent.objects.exists())
+
+    def test_complete_upload_with_wrong_hash(self):
+        """
+        Try to complete an upload whose data doesn't match the announced hash.
+        """
+        self.create_upload(sha256=hashlib.sha256(b"other data").hexdigest())
+        self.put_chunk(0, self.data)
+        response = self.complete_upload()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CapsuleContent.objects.exists())
+
+    def test_abort_upload(self):
+        """
+        Aborting an upload removes the data received so far.
+        """
+        self.create_upload()
+        self.put_chunk(0, self.data[:10])
+        file_path = self.upload.storage.path(self.upload.file_name)
+        self.assertTrue(os.path.isfile(file_path))
+        response = self.client.delete(self.get_api_url("/capsule-content-uploads/{pk}/", pk=self.upload.pk))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.isfile(file_path))
+
+    def test_expired_uploads_are_deleted(self):
+        """
+        Uploads which were not completed in time are deleted along with their data.
+        """
+        self.create_upload()
+        self.put_chunk(0, self.data[:10])
+        file_path = self.upload.storage.path(self.upload.file_name)
+        management.call_command("deleteexpireduploads")
+        self.assertTrue(CapsuleContentUpload.objects.exists())
+        CapsuleContentUpload.objects.update(
+            created_on=now() - timedelta(days=settings.CAPSULE_CONTENT_UPLOAD_EXPIRY_DAYS, minutes=1)
+        )
+        output = StringIO()
+        management.call_command("deleteexpireduploads", stdout=output)
+        self.assertIn("Deleted 1 expired uploads.", output.getvalue())
+        self.assertFalse(CapsuleContentUpload.objects.exists())
+        self.assertFalse(os.path.isfile(file_path))
+
+    def test_upload_chunk_of_removed_upload(self):
+        """
+        Try to upload a chunk for an upload which is removed concurrently.
+        """
+        self.create_upload()
+        get_object = CapsuleContentUploadViewSet.get_object
+
+        def get_and_remove_object(view):
+            upload = get_object(view)
+            CapsuleContentUpload.objects.filter(pk=upload.pk).delete()
+            return upload
+
+        with mock.patch.object(CapsuleContentUploadViewSet, "get_object", get_and_remove_object):
+            response = self.put_chunk(0, self.data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_unauthorized(self):
+        """
+        Try to upload a chunk for an upload of another user.
+        """
+        self.create_upload()
+        self.create_user()
+        self.authenticate_user()
+        response = self.put_chunk(0, self.data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def create_upload(self, sha256=None):
+        url = "/capsule-content-uploads/"
+        self.create_capsule()
+        self.authenticate_user()
+        with create_test_data_file(self.metadata) as metadata_file:
+            response = self.client.post(
+                self.get_api_url(url),
+                {
+                    "capsule": reverse("capsule", self.capsule),
+                    "metadata": metadata_file,
+                    "sha256": sha256 or hashlib.sha256(self.data).hexdigest(),
+                    "size": len(self.data),
+                },
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.upload = CapsuleContentUpload.objects.get()
+
+    def complete_upload(self):
+        url = "/capsule-content-uploads/{pk}/complete/"
+        return self.client.post(self.get_api_url(url, pk=self.upload.pk))
+
+    def put_chunk(self, offset, data):
+        url = "/capsule-content-uploads/{pk}/chunks/{offset}/"
+        return self.client.put(
+            self.get_api_url(url, pk=self.upload.pk, offset=offset), data, content_type="application/octet-stream"
+        )
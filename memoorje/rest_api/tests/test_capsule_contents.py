@@ -2,9 +2,10 @@ from base64 import b64encode
 import json
 import os
 
+from django.db import DatabaseError, transaction
 from rest_framework import status
 
-from memoorje.models import CapsuleContent
+from memoorje.models import Capsule, CapsuleContent
 from memoorje.rest_api.tests.utils import MemoorjeAPITestCase, reverse
 from memoorje.tests.memoorje import create_test_data_file
 from memoorje.tests.mixins import CapsuleContentMixin, CapsuleRecipientMixin
@@ -86,14 +87,57 @@ class CapsuleContentTestCase(CapsuleContentMixin, MemoorjeAPITestCase):
         self.capsule.refresh_from_db()
         self.assertGreater(self.capsule.updated_on, initial_updated_on)
 
-        # modify capsule's content
+        # modify capsule's content (the capsule is touched when the transaction is committed)
         initial_updated_on = self.capsule.updated_on
-        self.create_capsule_content()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_capsule_content()
+        self.capsule.refresh_from_db()
+        self.assertGreater(self.capsule.updated_on, initial_updated_on)
+        initial_updated_on = self.capsule.updated_on
+        with self.captureOnCommitCallbacks(execute=True):
+            self.capsule_content.delete()
+        self.capsule.refresh_from_db()
         self.assertGreater(self.capsule.updated_on, initial_updated_on)
+
+    def test_touch_capsule_once_per_transaction(self):
+        """
+        Several content modifications within a transaction touch the capsule only once.
+        """
+        self.create_capsule()
         initial_updated_on = self.capsule.updated_on
-        self.capsule_content.delete()
+        with self.captureOnCommitCallbacks() as callbacks:
+            for _ in range(3):
+                self.create_capsule_content()
+        # update the capsule (recipient tokens are not cached without a shared cache)
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.capsule.refresh_from_db()
         self.assertGreater(self.capsule.updated_on, initial_updated_on)
 
+    def test_touch_of_rolled_back_savepoint_is_dropped(self):
+        """
+        A capsule whose content modification was rolled back with a savepoint isn't touched, unless it is modified
+        again within the transaction.
+        """
+        self.create_capsule()
+        other_capsule = self.capsule
+        self.create_capsule()
+        initial_updated_on = dict(Capsule.objects.values_list("pk", "updated_on"))
+        with self.captureOnCommitCallbacks(execute=True):
+            for capsule in [other_capsule, self.capsule]:
+                try:
+                    with transaction.atomic():
+                        CapsuleContent.objects.create(capsule=capsule, metadata=b"Rolled back")
+                        raise DatabaseError()
+                except DatabaseError:
+                    pass
+            self.create_capsule_content()
+        other_capsule.refresh_from_db()
+        self.capsule.refresh_from_db()
+        self.assertEqual(other_capsule.updated_on, initial_updated_on[other_capsule.pk])
+        self.assertGreater(self.capsule.updated_on, initial_updated_on[self.capsule.pk])
+
     def test_list_capsule_contents(self):
         """
         List the contents for a capsule.
@@ -256,6 +256,19 @@ class AbortTestCase(KeyslotMixin, PartialKeyMixin, TrusteeMixin, MemoorjeAPITest
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertFalse(PartialKey.objects.exists())
 
+    def test_abort_does_not_change_other_capsules(self):
+        """Aborting a release process only resets the invitation state of the aborted capsule."""
+        url = "/capsules/{pk}/abort-release/"
+        other_capsule = self.create_capsule()
+        Capsule.objects.filter(pk=other_capsule.pk).update(are_partial_key_invitations_sent=True)
+        self.create_capsule()
+        self.create_partial_key()
+        self.authenticate_user()
+        response = self.client.post(self.get_api_url(url, pk=self.capsule.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        other_capsule.refresh_from_db()
+        self.assertTrue(other_capsule.are_partial_key_invitations_sent)
+
     def test_abort_unaccidental_release_removes_keyslot_and_trustees(self):
         """Aborting a release process, which was not accidentally initiated, removes the keyslot and all trustees."""
         url = "/capsules/{pk}/abort-release/"
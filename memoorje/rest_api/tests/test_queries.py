@@ -0,0 +1,90 @@
+from unittest import skipUnless
+
+from django.db import connection
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from memoorje.models import Keyslot
+from memoorje.rest_api.tests.utils import MemoorjeAPITestCase
+from memoorje.rest_api.views import CapsuleContentViewSet, CapsuleViewSet, KeyslotViewSet
+from memoorje.tests.memoorje import create_test_data_file
+from memoorje.tests.mixins import CapsuleContentMixin, CapsuleRecipientMixin, KeyslotMixin, TrusteeMixin
+
+
+class DetailQueriesTestCase(
+    CapsuleContentMixin, CapsuleRecipientMixin, KeyslotMixin, TrusteeMixin, MemoorjeAPITestCase
+):
+    """
+    The object permissions are checked with the query fetching the object, which loads the capsule along with it.
+    """
+
+    def test_keyslot_queries(self):
+        self.create_keyslot()
+        url = self.get_api_url("/keyslots/{pk}/", pk=self.keyslot.pk)
+        self.authenticate_user()
+        # session, user and keyslot (with capsule)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # additionally: update keyslot
+        with self.assertNumQueries(4):
+            response = self.client.patch(url, {"purpose": Keyslot.Purpose.SSS})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_capsule_content_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_capsule_content()
+        url = self.get_api_url("/capsule-contents/{pk}/", pk=self.capsule_content.pk)
+        self.authenticate_user()
+        # session, user and capsule content (with capsule)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # additionally: update capsule content and touch capsule on commit
+        with create_test_data_file(b"Changed metadata") as metadata_file:
+            with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(url, {"metadata": metadata_file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_capsule_recipient_queries(self):
+        self.create_capsule_recipient()
+        url = self.get_api_url("/capsule-recipients/{pk}/", pk=self.capsule_recipient.pk)
+        self.authenticate_user()
+        # session, user and recipient (with capsule)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # additionally: unique check, update recipient, owner (language of the confirmation email) and journal entry
+        with self.assertNumQueries(7):
+            response = self.client.patch(url, {"name": "Changed name"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_trustee_queries(self):
+        self.create_trustee()
+        url = self.get_api_url("/trustees/{pk}/", pk=self.trustee.pk)
+        self.authenticate_user()
+        # session, user and trustee (with capsule)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@skipUnless(connection.vendor == "sqlite", "The query plans are checked for SQLite.")
+class VisibilityQueryPlanTestCase(CapsuleContentMixin, CapsuleRecipientMixin, KeyslotMixin, MemoorjeAPITestCase):
+    """
+    The visibility filters of owned or received objects are answered with index lookups instead of table scans.
+    """
+
+    def test_owned_or_received_query_plans(self):
+        self.create_capsule_content()
+        self.create_keyslot()
+        self.create_capsule_recipient()
+        request = APIRequestFactory().get(
+            "/", **self.get_request_headers(with_recipient_token_for=self.capsule_recipient)
+        )
+        request.user = self.user
+        for viewset_class in (CapsuleViewSet, CapsuleContentViewSet, KeyslotViewSet):
+            with self.subTest(viewset=viewset_class.__name__):
+                queryset = viewset_class(request=request, format_kwarg=None).get_queryset()
+                self.assertEqual(queryset.count(), 1)
+                self.assertNotIn("SCAN", queryset.explain())
@@ -3,6 +3,7 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, Spec
 from rest_framework import routers
 
 from memoorje.rest_api.views import (
+    CapsuleContentUploadViewSet,
     CapsuleContentViewSet,
     CapsuleRecipientViewSet,
     CapsuleViewSet,
@@ -14,6 +15,7 @@ from memoorje.rest_api.views import (
 router = routers.SimpleRouter()
 router.register(r"capsules", CapsuleViewSet, basename="capsule")
 router.register(r"capsule-contents", CapsuleContentViewSet, basename="capsulecontent")
+router.register(r"capsule-content-uploads", CapsuleContentUploadViewSet, basename="capsulecontentupload")
 router.register(r"capsule-recipients", CapsuleRecipientViewSet, basename="capsulerecipient")
 router.register(r"keyslots", KeyslotViewSet, basename="keyslot")
 router.register(r"partial-keys", PartialKeyViewSet, basename="partialkey")
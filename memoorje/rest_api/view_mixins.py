@@ -1,6 +1,6 @@
-from django.db.models import Q
+from django.db.models import Exists, Q
 
-from memoorje.models import CapsuleRecipient
+from memoorje.models import Capsule, CapsuleRecipient
 from memoorje.utils import get_authenticated_user, get_recipient_by_token
 
 
@@ -12,8 +12,12 @@ class FilterMixin:
 
 class OwnedCapsuleRelatedFilterMixin(FilterMixin):
     def get_filter(self):
+        result = super().get_filter()
         user = get_authenticated_user(self.request)
-        return super().get_filter() | Q(capsule__owner=user)
+        if user is not None:
+            # a subquery instead of a join on the capsule avoids duplicate rows and allows for index lookups
+            result |= Q(capsule__in=Capsule.objects.filter(owner=user).values("pk"))
+        return result
 
 
 class ReceivedCapsuleRelatedFilterMixin(FilterMixin):
@@ -25,7 +29,10 @@ class ReceivedCapsuleRelatedFilterMixin(FilterMixin):
         return result
 
     def get_recipient_filter(self, recipient: CapsuleRecipient) -> Q:
-        return Q(capsule__recipients=recipient)
+        # the recipient might have been deleted since its token was cached
+        return Q(capsule=recipient.capsule_id) & Q(
+            Exists(CapsuleRecipient.objects.filter(pk=recipient.pk, capsule=recipient.capsule_id))
+        )
 
 
 class OwnedOrReceivedCapsuleRelatedFilterMixin(OwnedCapsuleRelatedFilterMixin, ReceivedCapsuleRelatedFilterMixin):
@@ -34,7 +41,8 @@ class OwnedOrReceivedCapsuleRelatedFilterMixin(OwnedCapsuleRelatedFilterMixin, R
 
 class FilteredQuerySetMixin(FilterMixin):
     def get_queryset(self):
-        return self.queryset.filter(self.get_filter())
+        # the capsule is needed for the permission checks
+        return self.queryset.select_related("capsule").filter(self.get_filter())
 
 
 class OwnedCapsuleRelatedQuerySetMixin(OwnedCapsuleRelatedFilterMixin, FilteredQuerySetMixin):
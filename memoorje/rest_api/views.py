@@ -1,17 +1,29 @@
+from io import BytesIO
+
+from django.db import transaction
 from django.db.models import Q
 from djeveric.views import ConfirmModelMixin
-from rest_framework import mixins, viewsets
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import exception_handler
 
-from memoorje.models import Capsule, CapsuleContent, CapsuleRecipient, Keyslot, Trustee
+from memoorje.models import (
+    Capsule,
+    CapsuleContent,
+    CapsuleContentUpload,
+    CapsuleContentUploadError,
+    CapsuleRecipient,
+    Keyslot,
+    Trustee,
+)
 from memoorje.rest_api.permissions import IsCapsuleOwner, IsCapsuleOwnerOrReadOnly
 from memoorje.rest_api.serializers import (
     AbortCapsuleReleaseSerializer,
     CapsuleContentSerializer,
+    CapsuleContentUploadSerializer,
     CapsuleRecipientSerializer,
     CapsuleSerializer,
     KeyslotSerializer,
@@ -54,7 +66,7 @@ class CapsuleViewSet(OwnedOrReceivedCapsuleRelatedQuerySetMixin, viewsets.ModelV
             capsule.keyslots.filter(purpose=Keyslot.Purpose.SSS).delete()
             capsule.trustees.all().delete()
         capsule.partial_keys.all().delete()
-        Capsule.objects.update(id=capsule.id, are_partial_key_invitations_sent=False)
+        Capsule.objects.filter(id=capsule.id).update(are_partial_key_invitations_sent=False)
 
 
 class CapsuleContentViewSet(OwnedOrReceivedCapsuleRelatedQuerySetMixin, viewsets.ModelViewSet):
@@ -66,6 +78,58 @@ class CapsuleContentViewSet(OwnedOrReceivedCapsuleRelatedQuerySetMixin, viewsets
     filterset_fields = ["capsule"]
 
 
+class CapsuleContentUploadViewSet(
+    OwnedCapsuleRelatedQuerySetMixin,
+    mixins.CreateModelMixin,
+    mixins.DestroyModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Chunked upload of capsule content data for authenticated users
+
+    After creating an upload, the data is sent in chunks with PUT requests to chunks/<offset>/, each starting where the
+    previous chunk ended. The received size tells where to resume an interrupted upload. Completing the upload checks
+    size and hash of the data and creates the capsule content.
+    """
+
+    permission_classes = [IsCapsuleOwner]
+    serializer_class = CapsuleContentUploadSerializer
+    queryset = CapsuleContentUpload.objects
+
+    def get_locked_object(self) -> CapsuleContentUpload:
+        """The upload locked until the end of the current transaction."""
+        upload: CapsuleContentUpload = self.get_object()
+        try:
+            return CapsuleContentUpload.objects.select_for_update().get(pk=upload.pk)
+        except CapsuleContentUpload.DoesNotExist:
+            # a concurrent request completed or deleted the upload (e.g. deleteexpireduploads)
+            raise NotFound()
+
+    @action(detail=True, methods=["put"], url_path=r"chunks/(?P<offset>[0-9]+)")
+    def chunk(self, request, offset, **kwargs):
+        with transaction.atomic():
+            # lock the upload, so chunks are appended one after the other
+            upload = self.get_locked_object()
+            try:
+                upload.append(int(offset), request.stream or BytesIO())
+            except CapsuleContentUploadError as e:
+                raise ValidationError(str(e), code="invalid_chunk")
+        return Response(self.get_serializer(upload).data)
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, **kwargs):
+        with transaction.atomic():
+            # lock the upload, so it is neither completed twice nor changed while completing it
+            upload = self.get_locked_object()
+            try:
+                content = upload.complete()
+            except CapsuleContentUploadError as e:
+                raise ValidationError(str(e), code="invalid_data")
+        serializer = CapsuleContentSerializer(content, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 class CapsuleRecipientViewSet(OwnedCapsuleRelatedFilterMixin, ConfirmModelMixin, viewsets.ModelViewSet):
     """Capsule recipient access for authenticated users"""
 
@@ -75,7 +139,7 @@ class CapsuleRecipientViewSet(OwnedCapsuleRelatedFilterMixin, ConfirmModelMixin,
     filterset_fields = ["capsule"]
 
     def get_basic_queryset(self):
-        return self.queryset.filter(self.get_filter())
+        return self.queryset.select_related("capsule").filter(self.get_filter())
 
     @action(methods=["post"], detail=True, url_path="send-confirmation-email")
     def resend(self, request, pk=None):
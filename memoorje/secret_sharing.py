@@ -0,0 +1,326 @@
+"""
+In-process implementation of `secret-share-combine` (see https://github.com/dsprenkels/sss-cli).
+
+A share is a single byte x-coordinate, followed by a 32 byte share of a random key (split with Shamir's Secret Sharing
+over GF(2^8)) and the secret encrypted with this key (XSalsa20-Poly1305 with an all zero nonce, i.e. NaCl's
+crypto_secretbox). All shares of a secret carry the same ciphertext.
+
+Running this module (`python -m memoorje.secret_sharing`) starts a long-lived combine worker. It reads frames from
+stdin, each containing hex encoded shares separated by newlines (just like the input of `secret-share-combine`), and
+responds with a frame containing a status byte followed by the secret or an error message. A frame is the payload
+prefixed with its length as a 4 byte unsigned big-endian integer. CombineWorkerPool manages such workers.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hmac
+import os
+import queue
+import selectors
+import struct
+import subprocess
+import sys
+import time
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Union
+
+KEY_SIZE = 32
+MAC_SIZE = 16
+NONCE_SIZE = 24
+KEYSHARE_SIZE = 1 + KEY_SIZE
+MIN_SHARE_SIZE = KEYSHARE_SIZE + MAC_SIZE
+
+
+class CombineError(Exception):
+    pass
+
+
+class CombineWorkerError(CombineError):
+    pass
+
+
+def _create_gf256_tables():
+    # GF(2^8) with the reduction polynomial x^8 + x^4 + x^3 + x + 1 and the generator x + 1
+    exp, log = [0] * 510, [0] * 256
+    value = 1
+    for power in range(255):
+        exp[power] = exp[power + 255] = value
+        log[value] = power
+        value ^= value << 1
+        if value & 0x100:
+            value ^= 0x11B
+    return exp, log
+
+
+_EXP, _LOG = _create_gf256_tables()
+
+
+def _mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _div(a: int, b: int) -> int:
+    if a == 0:
+        return 0
+    return _EXP[_LOG[a] + 255 - _LOG[b]]
+
+
+def combine_keyshares(keyshares: Sequence[bytes]) -> bytes:
+    """Restore the key from keyshares by Lagrange interpolation at x = 0."""
+    xs = [keyshare[0] for keyshare in keyshares]
+    if 0 in xs or len(set(xs)) != len(xs):
+        raise CombineError("Keyshares must have distinct non-zero indices.")
+    key = bytearray(KEY_SIZE)
+    for j, keyshare in enumerate(keyshares):
+        basis = 1
+        for m, x in enumerate(xs):
+            if m != j:
+                basis = _mul(basis, _div(x, x ^ xs[j]))
+        log_basis = _LOG[basis]
+        for i, y in enumerate(keyshare[1:KEYSHARE_SIZE]):
+            if y:
+                key[i] ^= _EXP[_LOG[y] + log_basis]
+    return bytes(key)
+
+
+def combine_shares(shares: Sequence[bytes]) -> bytes:
+    """
+    Restore the secret from the given shares.
+
+    :raise CombineError: If the shares are malformed, insufficient or don't belong to the same secret.
+    """
+    if len(shares) == 0:
+        raise CombineError("No shares given.")
+    if any(len(share) < MIN_SHARE_SIZE for share in shares):
+        raise CombineError("Share is too short.")
+    ciphertext = shares[0][KEYSHARE_SIZE:]
+    if any(share[KEYSHARE_SIZE:] != ciphertext for share in shares):
+        raise CombineError("Shares do not belong to the same secret.")
+    key = combine_keyshares([share[:KEYSHARE_SIZE] for share in shares])
+    return _secretbox_open(ciphertext, bytes(NONCE_SIZE), key)
+
+
+# XSalsa20-Poly1305
+
+
+def _rotl(value: int, count: int) -> int:
+    return ((value << count) & 0xFFFFFFFF) | (value >> (32 - count))
+
+
+def _quarter_round(x: List[int], a: int, b: int, c: int, d: int):
+    x[b] ^= _rotl((x[a] + x[d]) & 0xFFFFFFFF, 7)
+    x[c] ^= _rotl((x[b] + x[a]) & 0xFFFFFFFF, 9)
+    x[d] ^= _rotl((x[c] + x[b]) & 0xFFFFFFFF, 13)
+    x[a] ^= _rotl((x[d] + x[c]) & 0xFFFFFFFF, 18)
+
+
+def _salsa20_rounds(x: List[int]):
+    for _ in range(10):
+        _quarter_round(x, 0, 4, 8, 12)
+        _quarter_round(x, 5, 9, 13, 1)
+        _quarter_round(x, 10, 14, 2, 6)
+        _quarter_round(x, 15, 3, 7, 11)
+        _quarter_round(x, 0, 1, 2, 3)
+        _quarter_round(x, 5, 6, 7, 4)
+        _quarter_round(x, 10, 11, 8, 9)
+        _quarter_round(x, 15, 12, 13, 14)
+
+
+_SIGMA = struct.unpack("<4I", b"expand 32-byte k")
+
+
+def _salsa20_state(key: bytes, input_: bytes) -> List[int]:
+    k = struct.unpack("<8I", key)
+    i = struct.unpack("<4I", input_)
+    return [*_SIGMA[:1], *k[:4], _SIGMA[1], *i, _SIGMA[2], *k[4:], _SIGMA[3]]
+
+
+def _hsalsa20(key: bytes, nonce: bytes) -> bytes:
+    x = _salsa20_state(key, nonce)
+    _salsa20_rounds(x)
+    return struct.pack("<8I", *(x[i] for i in (0, 5, 10, 15, 6, 7, 8, 9)))
+
+
+def _xsalsa20_stream(key: bytes, nonce: bytes, length: int) -> bytes:
+    subkey = _hsalsa20(key, nonce[:16])
+    blocks = []
+    for counter in range((length + 63) // 64):
+        state = _salsa20_state(subkey, nonce[16:] + struct.pack("<Q", counter))
+        x = list(state)
+        _salsa20_rounds(x)
+        blocks.append(struct.pack("<16I", *((a + b) & 0xFFFFFFFF for a, b in zip(x, state))))
+    return b"".join(blocks)[:length]
+
+
+def _poly1305(message: bytes, key: bytes) -> bytes:
+    r = int.from_bytes(key[:16], "little") & 0x0FFFFFFC0FFFFFFC0FFFFFFC0FFFFFFF
+    s = int.from_bytes(key[16:], "little")
+    p = (1 << 130) - 5
+    accumulator = 0
+    for offset in range(0, len(message), 16):
+        block = message[offset : offset + 16] + b"\x01"
+        accumulator = (accumulator + int.from_bytes(block, "little")) * r % p
+    return ((accumulator + s) & ((1 << 128) - 1)).to_bytes(16, "little")
+
+
+def _secretbox_open(box: bytes, nonce: bytes, key: bytes) -> bytes:
+    mac, ciphertext = box[:MAC_SIZE], box[MAC_SIZE:]
+    stream = _xsalsa20_stream(key, nonce, 32 + len(ciphertext))
+    if not hmac.compare_digest(_poly1305(ciphertext, stream[:32]), mac):
+        raise CombineError("Shares are insufficient or invalid.")
+    return bytes(a ^ b for a, b in zip(ciphertext, stream[32:]))
+
+
+# framed combine worker protocol
+
+_FRAME_HEADER = struct.Struct(">I")
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    header = stream.read(_FRAME_HEADER.size)
+    if len(header) < _FRAME_HEADER.size:
+        return None
+    (length,) = _FRAME_HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return payload
+
+
+def write_frame(stream: BinaryIO, payload: bytes):
+    stream.write(_FRAME_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def encode_shares(shares: Iterable[bytes]) -> bytes:
+    return "\n".join(share.hex() for share in shares).encode()
+
+
+def serve(stdin: BinaryIO, stdout: BinaryIO):
+    """Answer combine requests until stdin is closed."""
+    while (request := read_frame(stdin)) is not None:
+        try:
+            shares = [bytes.fromhex(line) for line in request.decode().split()]
+            response = bytes([STATUS_OK]) + combine_shares(shares)
+        except (CombineError, ValueError) as e:
+            response = bytes([STATUS_ERROR]) + str(e).encode()
+        write_frame(stdout, response)
+
+
+class _CombineWorker:
+    def __init__(self, command: Sequence[str]):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._buffer = b""
+
+    def request(self, payload: bytes, timeout: float) -> bytes:
+        write_frame(self.process.stdin, payload)
+        deadline = time.monotonic() + timeout
+        header = self._read(_FRAME_HEADER.size, deadline)
+        (length,) = _FRAME_HEADER.unpack(header)
+        return self._read(length, deadline)
+
+    def _read(self, size: int, deadline: float) -> bytes:
+        fd = self.process.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while len(self._buffer) < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    raise TimeoutError("Combine worker did not respond in time.")
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise CombineWorkerError("Combine worker exited unexpectedly.")
+                self._buffer += chunk
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        return result
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class CombineWorkerPool:
+    """
+    A pool of long-lived combine worker processes.
+
+    Workers are started on demand. Workers which crash or exceed the timeout are replaced by new ones and a job is
+    retried once if its worker crashed. The pool is thread-safe, so up to `size` jobs are processed in parallel.
+    """
+
+    def __init__(self, command: Sequence[str], size: int, timeout: float):
+        self.command = command
+        self.size = size
+        self.timeout = timeout
+        self._is_closed = False
+        # idle workers (None is a placeholder for a worker which isn't started yet)
+        self._workers = queue.LifoQueue()
+        for _ in range(size):
+            self._workers.put(None)
+
+    def combine(self, shares: Sequence[bytes]) -> bytes:
+        payload = encode_shares(shares)
+        for attempt in range(2):
+            worker = self._workers.get()
+            try:
+                if self._is_closed:
+                    raise CombineWorkerError("Combine worker pool is closed.")
+                if worker is None:
+                    worker = _CombineWorker(self.command)
+                response = worker.request(payload, self.timeout)
+            except TimeoutError as e:
+                worker.kill()
+                worker = None
+                raise CombineWorkerError(str(e)) from e
+            except (CombineWorkerError, OSError) as e:
+                if worker is not None:
+                    worker.kill()
+                    worker = None
+                if attempt > 0 or self._is_closed:
+                    raise CombineWorkerError(str(e)) from e
+                continue
+            finally:
+                self._workers.put(worker)
+            if response[:1] != bytes([STATUS_OK]):
+                raise CombineError(response[1:].decode(errors="replace"))
+            return response[1:]
+
+    def map(
+        self, share_sets: Iterable[Sequence[bytes]], return_exceptions: bool = False
+    ) -> List[Union[bytes, CombineError]]:
+        """
+        Combine multiple sets of shares in parallel.
+
+        :param return_exceptions: Return the error for a set of shares which cannot be combined instead of raising it.
+        """
+        combine = self._combine_or_error if return_exceptions else self.combine
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(combine, share_sets))
+
+    def _combine_or_error(self, shares: Sequence[bytes]) -> Union[bytes, CombineError]:
+        try:
+            return self.combine(shares)
+        except CombineError as e:
+            return e
+
+    def close(self):
+        """Stop all workers (waiting for running jobs to finish)."""
+        self._is_closed = True
+        workers = [self._workers.get() for _ in range(self.size)]
+        for worker in workers:
+            if worker is not None:
+                worker.close()
+            self._workers.put(None)
+
+
+if __name__ == "__main__":
+    serve(sys.stdin.buffer, sys.stdout.buffer)
@@ -9,9 +9,11 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+
 import collections
 import os
 from pathlib import Path
+import sys
 
 from memoorje.emails import convert_html_to_text
 
@@ -197,16 +199,59 @@ SPECTACULAR_SETTINGS = {
 
 CAPSULE_DATA_DIR = MEDIA_ROOT / "data"
 
+# Use "memoorje.data_storage.storage.ContentAddressedCapsuleDataStorage" in order to store identical files only once.
+CAPSULE_DATA_STORAGE = "memoorje.data_storage.storage.CapsuleDataStorage"
+
+# Capsule data downloads are streamed by Django. Set to "x-accel-redirect" (nginx) or "x-sendfile" (e.g. Apache with
+# mod_xsendfile) in order to let the web server send the file after the access check. With nginx, the files in
+# CAPSULE_DATA_DIR need to be available at CAPSULE_DATA_INTERNAL_URL in an internal location.
+CAPSULE_DATA_DOWNLOAD_OFFLOAD = None
+
+CAPSULE_DATA_INTERNAL_URL = "/media/data/"
+
+# uploads of capsule content data in chunks are written (and hashed) with buffers of this size
+CAPSULE_CONTENT_UPLOAD_BUFFER_SIZE = 64 * 1024
+
+# uploads which were not completed within this many days are deleted along with their data (see deleteexpireduploads)
+CAPSULE_CONTENT_UPLOAD_EXPIRY_DAYS = 7
+
 DEFAULT_REMIND_INTERVAL_MONTHS = 6
 
+REMINDER_BATCH_SIZE = 500
+
 RECIPIENT_PASSWORD_LENGTH = 32
 
+# Partial keys are combined in-process. Use "memoorje.crypto.combine_shares_with_subprocess" in order to run the
+# secret-share-combine binary found at SECRET_SHARE_COMBINE_PATH instead or
+# "memoorje.crypto.combine_shares_with_worker_pool" for a pool of long-lived SECRET_SHARE_COMBINE_WORKER_COMMAND
+# processes (see memoorje.secret_sharing for the protocol).
+SECRET_SHARE_COMBINE_BACKEND = "memoorje.crypto.combine_shares_in_process"
+
 SECRET_SHARE_COMBINE_PATH = Path("~/.cargo/bin/secret-share-combine").expanduser()
 
+# the workers are run by the interpreter running memoorje (e.g. within a virtualenv)
+SECRET_SHARE_COMBINE_WORKER_COMMAND = [sys.executable, "-m", "memoorje.secret_sharing"]
+
+# number of combine worker processes (None: number of CPUs)
+SECRET_SHARE_COMBINE_WORKERS = None
+
+SECRET_SHARE_COMBINE_TIMEOUT_SECONDS = 10
+
 INACTIVE_RECIPIENT_HINT_DAYS = 7
 
+# Checked recipient tokens are cached for this long. Tokens of changed capsules or recipients are dropped right away.
+# Tokens are only cached if CACHES configures a cache shared by all processes (i.e. not the default local memory cache).
+RECIPIENT_TOKEN_CACHE_SECONDS = 60
+
 CAPSULE_RELEASE_GRACE_PERIOD_DAYS = 3
 
+# number of processes encrypting recipient keyslots on release (None: number of CPUs, 1: no extra processes)
+CAPSULE_RELEASE_WORKERS = None
+
+CAPSULE_RELEASE_BATCH_SIZE = 50
+
+CAPSULE_IMPORT_BATCH_SIZE = 500
+
 TWO_FACTOR_BACKUP_TOKEN_COUNT = 10
 
 TEMPLATED_EMAIL_PLAIN_FUNCTION = convert_html_to_text
@@ -249,6 +294,8 @@ FRONTEND_LINKS = _OriginPrefixedURLs(
 
 MONTHLY_DUE_PER_CAPSULE = 1
 
+TRANSACTION_PAGE_SIZE = 100
+
 CURRENCY_REPRESENTATION = {
     "max_digits": 8,
     "decimal_places": 2,
@@ -256,6 +303,31 @@ CURRENCY_REPRESENTATION = {
 
 EXPENSE_TYPE_AMOUNT_SUM_REFERENCE_PERIOD_MONTHS = 6
 
+# number of account balances updated with a single query
+ACCOUNT_BALANCE_UPDATE_BATCH_SIZE = 500
+
+# The amount sums are refreshed in the cache when expenses change. With the default local memory cache (see CACHES)
+# only the process handling the change is refreshed, the others keep their sums for up to this long.
+EXPENSE_TYPE_AMOUNT_SUM_CACHE_SECONDS = 15 * 60
+
 JOURNAL_NOTIFICATION_GRACE_PERIOD_MINUTES = 5
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+
+# Store emails in the database instead of sending them right away. They are sent by the flushmailqueue command.
+EMAIL_QUEUE_ENABLED = False
+
+EMAIL_QUEUE_BATCH_SIZE = 100
+
+# emails which failed this often are deleted (the failure is logged)
+EMAIL_QUEUE_MAX_ATTEMPTS = 8
+
+# delay before the first retry (doubled for each further retry)
+EMAIL_QUEUE_RETRY_DELAY_SECONDS = 60
+
+# maximum number of emails sent per second (None: unlimited)
+EMAIL_QUEUE_RATE_LIMIT = None
+
+# Emails taken from the queue are not tried again by other runs of flushmailqueue for this long. It should exceed the
+# time needed to send a batch (see EMAIL_QUEUE_BATCH_SIZE and EMAIL_QUEUE_RATE_LIMIT).
+EMAIL_QUEUE_LEASE_SECONDS = 30 * 60
@@ -1,20 +1,57 @@
+import functools
+
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from memoorje.models import Capsule, CapsuleContent, CapsuleRecipient, JournalEntry, PartialKey
+from memoorje.utils import forget_recipient_tokens
+
+
+class PendingCapsuleTouches:
+    """
+    Capsules to be touched once the current transaction is committed. Each touch registers a callback of its own, so
+    touches rolled back along with a savepoint are dropped by Django. When the callbacks run, each capsule is touched
+    only once.
+    """
+
+    def __init__(self):
+        self.touched_capsule_ids = set()
+        self.is_flushed = False
+
+    def touch(self, capsule_id):
+        self.is_flushed = True
+        if capsule_id not in self.touched_capsule_ids:
+            self.touched_capsule_ids.add(capsule_id)
+            # an update, which neither saves the whole capsule nor sends model signals
+            Capsule.objects.filter(pk=capsule_id).update(updated_on=timezone.now())
+            forget_recipient_tokens(CapsuleRecipient.objects.filter(capsule=capsule_id).values_list("pk", flat=True))
+
+
+def touch_capsule_on_commit(capsule_id):
+    """Touch the capsule once the current transaction is committed. All touches of a capsule are coalesced."""
+    connection = transaction.get_connection()
+    pending = getattr(connection, "pending_capsule_touches", None)
+    # Touches of committed transactions (or outside of transactions) have run already. The touches of a rolled back
+    # transaction were never run, so they can be shared with the next transaction.
+    if pending is None or pending.is_flushed:
+        pending = connection.pending_capsule_touches = PendingCapsuleTouches()
+    # runs right away outside of transactions
+    transaction.on_commit(functools.partial(pending.touch, capsule_id))
 
 
 @receiver(post_delete, sender=CapsuleContent)
 @receiver(post_save, sender=CapsuleContent)
 def touch_capsule(instance: CapsuleContent, **kwargs):
-    instance.capsule.touch()
+    touch_capsule_on_commit(instance.capsule_id)
 
 
 @receiver(post_delete, sender=CapsuleRecipient)
 @receiver(post_save, sender=CapsuleRecipient)
 def create_journal_entry(instance, **kwargs):
     def _create_journal_entry(action):
-        entry = JournalEntry(user=instance.capsule.owner, capsule=instance.capsule, action=action)
+        entry = JournalEntry(user_id=instance.capsule.owner_id, capsule=instance.capsule, action=action)
         entry.entity = instance
         entry.save()
 
@@ -34,7 +71,13 @@ def send_release_init_notification(instance: PartialKey, created: bool, **kwargs
 
 
 @receiver(post_save, sender=Capsule)
-def set_recursive_capsule_relation(instance: Capsule, created: bool, **kwargs):
-    if created:
-        instance.capsule = instance
-        instance.save()
+def forget_capsule_recipient_tokens(instance: Capsule, created: bool, **kwargs):
+    # the tokens depend on Capsule.updated_on
+    if not created:
+        forget_recipient_tokens(instance.recipients.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=CapsuleRecipient)
+@receiver(post_save, sender=CapsuleRecipient)
+def forget_recipient_token(instance: CapsuleRecipient, **kwargs):
+    forget_recipient_tokens([instance.pk])
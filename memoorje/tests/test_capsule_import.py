@@ -0,0 +1,117 @@
+from base64 import b64encode
+from io import StringIO
+import json
+from tempfile import NamedTemporaryFile
+
+from django.core import mail, management
+from django.core.management import CommandError
+from django.test import TestCase
+
+from memoorje.models import Capsule, CapsuleContent, CapsuleRecipient, Keyslot, PartialKey, Trustee
+from memoorje.tests.mixins import CapsuleMixin
+
+
+class CapsuleCreationTestCase(CapsuleMixin, TestCase):
+    def test_create_capsule_with_single_write(self):
+        self.create_user()
+        with self.assertNumQueries(1):
+            capsule = Capsule.objects.create(owner=self.user, name="Capsule")
+        capsule.refresh_from_db()
+        self.assertEqual(capsule.capsule_id, capsule.id)
+
+    def test_bulk_create_capsules(self):
+        self.create_user()
+        capsules = Capsule.objects.bulk_create(Capsule(owner=self.user, name=f"Capsule {i}") for i in range(3))
+        for capsule in capsules:
+            capsule.refresh_from_db()
+            self.assertEqual(capsule.capsule_id, capsule.id)
+
+
+class CapsuleImportTestCase(CapsuleMixin, TestCase):
+    def setUp(self):
+        self.create_user()
+        self.data = b"Some encrypted data"
+        self.metadata = b"Some encrypted metadata"
+        self.partial_key_hash = PartialKey.hash_key_data(b"Partial key data")
+        self.keyslot_data = b"Some encrypted key"
+
+    def test_import_ndjson(self):
+        """
+        Import capsules with their contents, recipients, trustees and keyslots from an NDJSON file in batches.
+        """
+        records = [self._create_record(f"Capsule {i}") for i in range(3)]
+        mail.outbox.clear()
+        output = self._import("\n".join(json.dumps(record) for record in records), batch_size=2)
+        self.assertIn("Imported 3 capsules.", output)
+        self.assertEqual(Capsule.objects.filter(owner=self.user).count(), 3)
+        capsule = Capsule.objects.get(name="Capsule 1")
+        self.assertEqual(capsule.capsule_id, capsule.id)
+        content = CapsuleContent.objects.get(capsule=capsule)
+        self.assertEqual(bytes(content.metadata), self.metadata)
+        self.assertEqual(content.data.read(), self.data)
+        self.assertEqual(CapsuleRecipient.objects.get(capsule=capsule).email, "recipient@example.org")
+        self.assertEqual(bytes(Trustee.objects.get(capsule=capsule).partial_key_hash), self.partial_key_hash)
+        password_keyslot = Keyslot.objects.get(capsule=capsule, purpose=Keyslot.Purpose.PASSWORD)
+        self.assertEqual(bytes(password_keyslot.data), self.keyslot_data)
+        self.assertEqual(password_keyslot.recipient, CapsuleRecipient.objects.get(capsule=capsule))
+        self.assertIsNone(Keyslot.objects.get(capsule=capsule, purpose=Keyslot.Purpose.SSS).recipient)
+        # no confirmation emails for imported recipients
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_import_json(self):
+        """
+        Import capsules from a JSON list.
+        """
+        self._import(json.dumps([self._create_record("Capsule 1"), {"owner": self.email, "name": "Capsule 2"}]))
+        self.assertEqual(Capsule.objects.count(), 2)
+
+    def test_import_unknown_owner(self):
+        """
+        Try to import a capsule of a user who doesn't exist.
+        """
+        record = self._create_record("Capsule 1")
+        record["owner"] = "unknown@example.org"
+        with self.assertRaises(CommandError):
+            self._import(json.dumps(record))
+        self.assertFalse(Capsule.objects.exists())
+
+    def test_import_duplicate_recipients(self):
+        """
+        Try to import a capsule with the same recipient twice.
+        """
+        record = self._create_record("Capsule 1")
+        record["recipients"] *= 2
+        with self.assertRaises(CommandError):
+            self._import(json.dumps(record))
+        self.assertFalse(Capsule.objects.exists())
+
+    def test_import_keyslot_of_unknown_recipient(self):
+        """
+        Try to import a keyslot for a recipient who isn't one of the capsule recipients.
+        """
+        record = self._create_record("Capsule 1")
+        record["keyslots"][0]["recipient"] = "unknown@example.org"
+        with self.assertRaises(CommandError):
+            self._import(json.dumps(record))
+        self.assertFalse(Capsule.objects.exists())
+
+    def _create_record(self, name):
+        return {
+            "owner": self.email,
+            "name": name,
+            "contents": [{"metadata": b64encode(self.metadata).decode(), "data": b64encode(self.data).decode()}],
+            "recipients": [{"email": "recipient@example.org"}],
+            "trustees": [{"email": "trustee@example.org", "partial_key_hash": self.partial_key_hash.hex()}],
+            "keyslots": [
+                {"purpose": "pwd", "data": b64encode(self.keyslot_data).decode(), "recipient": "recipient@example.org"},
+                {"purpose": "sss", "data": b64encode(self.keyslot_data).decode()},
+            ],
+        }
+
+    def _import(self, content, **options):
+        with NamedTemporaryFile("w", suffix=".json") as f:
+            f.write(content)
+            f.flush()
+            output = StringIO()
+            management.call_command("importcapsules", f.name, stdout=output, **options)
+        return output.getvalue()
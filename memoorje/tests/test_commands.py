@@ -1,8 +1,14 @@
+from smtplib import SMTPException
+from unittest import mock
+
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.core import mail, management
+from django.core.mail.backends.locmem import EmailBackend
 from django.test import TestCase
+from django.utils.timezone import now
 
+from memoorje.models import CapsuleRecipient, PartialKey
 from memoorje.tests.mixins import CapsuleRecipientMixin, PartialKeyMixin, TrusteeMixin
 
 
@@ -21,6 +27,33 @@ class HintTestCase(CapsuleRecipientMixin, TestCase):
         management.call_command("sendcapsulehints")
         self.assertEqual(len(mail.outbox), 1)
 
+    def test_hints_list_only_inactive_recipients(self):
+        self.create_capsule_recipient()
+        self.create_capsule_recipient(email="confirmed@example.org")
+        CapsuleRecipient.objects.update(
+            created_on=now() - relativedelta(days=settings.INACTIVE_RECIPIENT_HINT_DAYS, minutes=1)
+        )
+        self.capsule_recipient.is_email_confirmed = True
+        self.capsule_recipient.save()
+        mail.outbox.clear()
+        management.call_command("sendcapsulehints")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertIn("recipient@example.org", mail.outbox[0].body)
+        self.assertNotIn("confirmed@example.org", mail.outbox[0].body)
+
+    def test_hints_queries_do_not_depend_on_capsule_count(self):
+        for _ in range(3):
+            self.create_capsule()
+            self.create_capsule_recipient()
+        CapsuleRecipient.objects.update(
+            created_on=now() - relativedelta(days=settings.INACTIVE_RECIPIENT_HINT_DAYS, minutes=1)
+        )
+        mail.outbox.clear()
+        with self.assertNumQueries(1):
+            management.call_command("sendcapsulehints")
+        self.assertEqual(len(mail.outbox), 3)
+
 
 class InvitationTestCase(PartialKeyMixin, TrusteeMixin, TestCase):
     def test_invitations_sent_to_trustees(self):
@@ -36,3 +69,48 @@ class InvitationTestCase(PartialKeyMixin, TrusteeMixin, TestCase):
             self.assertIn(self.capsule.name, m.body)
             self.assertIn(self.capsule.description, m.body)
             self.assertIn(str(self.capsule.pk), m.body)
+
+    def test_invitations_sent_only_once(self):
+        self.create_trustee()
+        self.create_partial_key()
+        PartialKey.objects.update(created_on=now() - relativedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS))
+        management.call_command("sendpartialkeyinvitations")
+        mail.outbox.clear()
+        management.call_command("sendpartialkeyinvitations")
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_invitations_sent_again_after_failure(self):
+        self.create_trustee()
+        self.create_partial_key()
+        PartialKey.objects.update(created_on=now() - relativedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS))
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("unavailable")):
+            management.call_command("sendpartialkeyinvitations")
+        self.capsule.refresh_from_db()
+        self.assertFalse(self.capsule.are_partial_key_invitations_sent)
+        mail.outbox.clear()
+        management.call_command("sendpartialkeyinvitations")
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_invitations_flag_set_only_for_invited_capsules(self):
+        other_capsule = self.create_capsule()
+        self.create_capsule()
+        self.create_trustee()
+        self.create_partial_key()
+        PartialKey.objects.update(created_on=now() - relativedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS))
+        management.call_command("sendpartialkeyinvitations")
+        self.capsule.refresh_from_db()
+        other_capsule.refresh_from_db()
+        self.assertTrue(self.capsule.are_partial_key_invitations_sent)
+        self.assertFalse(other_capsule.are_partial_key_invitations_sent)
+
+    def test_invitations_queries_do_not_depend_on_capsule_count(self):
+        for _ in range(3):
+            self.create_capsule()
+            self.create_trustee()
+            self.create_partial_key()
+        PartialKey.objects.update(created_on=now() - relativedelta(days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS))
+        mail.outbox.clear()
+        # select capsules, prefetch trustees and update capsules
+        with self.assertNumQueries(3):
+            management.call_command("sendpartialkeyinvitations")
+        self.assertEqual(len(mail.outbox), 3)
@@ -1,13 +1,25 @@
-from django.test import TestCase
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+from unittest import skipUnless
+
+from django.conf import settings
+from django.test import override_settings, TestCase
 
 from memoorje.crypto import (
     _combine_partial_keys,
     _create_recipient_keyslots,
     _decrypt_secret,
     _encrypt_secret,
+    _start_recipient_keyslots,
+    combine_shares_in_process,
+    combine_shares_with_subprocess,
+    combine_shares_with_worker_pool,
+    get_combine_worker_pool,
     RecryptError,
 )
 from memoorje.models import Keyslot
+from memoorje.secret_sharing import CombineError, CombineWorkerError, CombineWorkerPool
 from memoorje.tests.mixins import CapsuleRecipientMixin, KeyslotMixin, PartialKeyMixin
 
 
@@ -45,3 +57,96 @@ class CryptoTestCase(KeyslotMixin, CapsuleRecipientMixin, PartialKeyMixin, TestC
         keyslot = self.capsule.keyslots.get(purpose=Keyslot.Purpose.PASSWORD)
         result = keyslot.decrypt(passwords[self.capsule_recipient])
         self.assertEqual(result, secret)
+
+    def test_create_recipient_keyslots_with_executor(self):
+        """Keyslots may be encrypted by (multiple) worker processes."""
+        secret = b"Very hidden secret!"
+        recipients = [self.create_capsule_recipient(f"recipient{i}@example.org") for i in range(2)]
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            passwords = _create_recipient_keyslots(self.capsule, secret, executor)
+        self.assertEqual(self.capsule.keyslots.filter(purpose=Keyslot.Purpose.PASSWORD).count(), 2)
+        for recipient in recipients:
+            keyslot = self.capsule.keyslots.get(recipient=recipient)
+            self.assertEqual(keyslot.decrypt(passwords[recipient]), secret)
+
+    def test_create_recipient_keyslots_with_single_insert(self):
+        """All keyslots are stored at once after their encryption is done."""
+        for i in range(3):
+            self.create_capsule_recipient(f"recipient{i}@example.org")
+        pending_keyslots = _start_recipient_keyslots(self.capsule, b"Very hidden secret!")
+        with self.assertNumQueries(1):
+            passwords = pending_keyslots.create()
+        self.assertEqual(len(passwords), 3)
+        self.assertEqual(self.capsule.keyslots.filter(purpose=Keyslot.Purpose.PASSWORD).count(), 3)
+
+
+class CombineSharesTestCase(PartialKeyMixin, TestCase):
+    def setUp(self):
+        self.create_combinable_partial_keys()
+        self.shares = [key.data for key in self.capsule.partial_keys.order_by("pk")]
+
+    def test_combine_in_process_matches_subprocess(self):
+        """Both combine backends shall restore the same secret."""
+        self.assertEqual(combine_shares_in_process(self.shares), self.combined_secret)
+        self.assertEqual(combine_shares_in_process(self.shares), combine_shares_with_subprocess(self.shares))
+        self.assertEqual(combine_shares_in_process(list(reversed(self.shares))), self.combined_secret)
+
+    def test_combine_in_process_insufficient_shares_raises_error(self):
+        self.assertRaises(RecryptError, combine_shares_in_process, self.shares[:1])
+        self.assertRaises(RecryptError, combine_shares_with_subprocess, self.shares[:1])
+
+    def test_combine_in_process_invalid_shares_raises_error(self):
+        tampered_share = self.shares[1][:-1] + bytes([self.shares[1][-1] ^ 1])
+        self.assertRaises(RecryptError, combine_shares_in_process, [self.shares[0], tampered_share])
+        self.assertRaises(RecryptError, combine_shares_in_process, [self.shares[0], self.shares[0]])
+        self.assertRaises(RecryptError, combine_shares_in_process, [self.shares[0][:40], self.shares[1][:40]])
+        self.assertRaises(RecryptError, combine_shares_in_process, [])
+
+
+class CombineWorkerPoolTestCase(PartialKeyMixin, TestCase):
+    def setUp(self):
+        self.create_combinable_partial_keys()
+        self.shares = [key.data for key in self.capsule.partial_keys.all()]
+        self.pool = CombineWorkerPool(settings.SECRET_SHARE_COMBINE_WORKER_COMMAND, size=2, timeout=10)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_combine_many_share_sets(self):
+        self.assertEqual(self.pool.map([self.shares] * 10), [self.combined_secret] * 10)
+
+    def test_combine_invalid_shares_raises_error(self):
+        self.assertRaises(CombineError, self.pool.combine, self.shares[:1])
+        self.assertEqual(self.pool.combine(self.shares), self.combined_secret)
+
+    def test_crashed_worker_is_restarted(self):
+        self.pool.combine(self.shares)
+        worker = self.pool._workers.get()
+        worker.kill()
+        self.pool._workers.put(worker)
+        self.assertEqual(self.pool.combine(self.shares), self.combined_secret)
+
+    def test_timeout_kills_worker(self):
+        pool = CombineWorkerPool(["sleep", "10"], size=1, timeout=0.1)
+        self.assertRaises(CombineWorkerError, pool.combine, self.shares)
+        pool.close()
+
+    @override_settings(SECRET_SHARE_COMBINE_BACKEND="memoorje.crypto.combine_shares_with_worker_pool")
+    def test_combine_partial_keys_with_worker_pool(self):
+        self.assertEqual(_combine_partial_keys(self.capsule.partial_keys.all()), self.combined_secret)
+        self.assertRaises(RecryptError, _combine_partial_keys, [self.capsule.partial_keys.first()])
+
+
+@skipUnless(os.environ.get("MEMOORJE_BENCHMARK"), "set MEMOORJE_BENCHMARK=1 to run benchmarks")
+class CombineSharesBenchmarkTestCase(PartialKeyMixin, TestCase):
+    def test_combine_shares_for_1k_capsules(self):
+        self.create_combinable_partial_keys()
+        shares = [key.data for key in self.capsule.partial_keys.all()]
+        for combine_shares in [combine_shares_in_process, combine_shares_with_subprocess]:
+            started_at = time.perf_counter()
+            for _ in range(1000):
+                combine_shares(shares)
+            print(f"{combine_shares.__name__}: {time.perf_counter() - started_at:.2f}s for 1000 capsules")
+        started_at = time.perf_counter()
+        get_combine_worker_pool().map([shares] * 1000)
+        print(f"{combine_shares_with_worker_pool.__name__}: {time.perf_counter() - started_at:.2f}s for 1000 capsules")
@@ -0,0 +1,102 @@
+import os
+from smtplib import SMTPException
+import time
+from unittest import mock, skipUnless
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.template import loader
+from django.test import TestCase
+from django.utils import translation
+from templated_email import get_templated_mail
+
+from memoorje.emails import (
+    EmailRenderer,
+    get_email_renderer,
+    JournalNotificationEmail,
+    ReminderEmail,
+    send_templated_emails,
+)
+from memoorje.tests.mixins import CapsuleMixin
+
+
+class EmailRendererTestCase(CapsuleMixin, TestCase):
+    def setUp(self):
+        self.create_capsule()
+        self.context = ReminderEmail(self.user.email).get_context(instance=self.user)
+
+    def test_render_matches_templated_email(self):
+        expected = get_templated_mail("owner_reminder", dict(self.context), to=[self.user.email])
+        message = get_email_renderer().render("owner_reminder", self.context, [self.user.email])
+        self.assertEqual(message.subject, expected.subject)
+        self.assertEqual(message.body, expected.body)
+        self.assertEqual(message.alternatives, expected.alternatives)
+        self.assertEqual(message.to, [self.user.email])
+
+    def test_templates_are_loaded_once(self):
+        renderer = EmailRenderer()
+        with mock.patch.object(loader, "get_template", wraps=loader.get_template) as get_template:
+            messages = renderer.render_many(
+                "owner_reminder", [(self.context, [f"test{i}@example.org"]) for i in range(3)]
+            )
+        self.assertEqual(get_template.call_count, 1)
+        self.assertEqual([m.to for m in messages], [[f"test{i}@example.org"] for i in range(3)])
+
+    def test_send_templated_emails(self):
+        mail.outbox.clear()
+        send_templated_emails([(ReminderEmail(self.user.email), {"instance": self.user})] * 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("Kapsel", mail.outbox[0].subject)
+
+
+class EmailLanguageTestCase(CapsuleMixin, TestCase):
+    def test_render_restores_active_language(self):
+        user = self.create_user(language="de")
+        with translation.override("en"):
+            message = JournalNotificationEmail(user.email).render(instance=user)
+            self.assertEqual(translation.get_language(), "en")
+        self.assertIn("Kapseländerungen", message.subject)
+
+    def test_send_templated_emails_grouped_by_language(self):
+        users = [self.create_user(language=language) for language in ["de", "en", "de", "en"]]
+        mail.outbox.clear()
+        with translation.override("en"):
+            with mock.patch.object(translation, "override", wraps=translation.override) as override:
+                send_templated_emails([(JournalNotificationEmail(u.email), {"instance": u}) for u in users], workers=2)
+            self.assertEqual(translation.get_language(), "en")
+        self.assertEqual(override.call_count, 2)
+        subjects = {m.to[0]: m.subject for m in mail.outbox}
+        for user in users:
+            self.assertIn("Kapseländerungen" if user.language == "de" else "Capsule changes", subjects[user.email])
+
+    def test_send_templated_emails_reports_failures_in_order(self):
+        users = [self.create_user(language=language) for language in ["de", "en", "de"]]
+        mail.outbox.clear()
+        send_messages = EmailBackend.send_messages
+
+        def fail_for_second_user(backend, messages):
+            if messages[0].to == [users[1].email]:
+                raise SMTPException("rejected")
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, "send_messages", autospec=True, side_effect=fail_for_second_user):
+            sent = send_templated_emails(
+                [(JournalNotificationEmail(u.email), {"instance": u}) for u in users], fail_silently=True
+            )
+        self.assertEqual(sent, [True, False, True])
+        self.assertEqual({m.to[0] for m in mail.outbox}, {users[0].email, users[2].email})
+
+
+@skipUnless(os.environ.get("MEMOORJE_BENCHMARK"), "set MEMOORJE_BENCHMARK=1 to run benchmarks")
+class EmailRenderingBenchmarkTestCase(CapsuleMixin, TestCase):
+    def test_render_reminders(self):
+        count = 1000
+        self.create_capsule()
+        context = ReminderEmail(self.user.email).get_context(instance=self.user)
+        started_at = time.perf_counter()
+        for _ in range(count):
+            get_templated_mail("owner_reminder", dict(context), to=[self.user.email])
+        print(f"get_templated_mail: {count / (time.perf_counter() - started_at):.0f} messages/s")
+        started_at = time.perf_counter()
+        get_email_renderer().render_many("owner_reminder", [(context, [self.user.email])] * count)
+        print(f"EmailRenderer.render_many: {count / (time.perf_counter() - started_at):.0f} messages/s")
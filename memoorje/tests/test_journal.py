@@ -1,7 +1,10 @@
 from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
 
 from django.conf import settings
 from django.core import mail, management
+from django.core.mail.backends.locmem import EmailBackend
 from django.test import TestCase
 from django.utils.timezone import now
 from freezegun import freeze_time
@@ -41,10 +44,42 @@ class JournalTestCase(CapsuleRecipientMixin, TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn(test_str, mail.outbox[0].body)
 
-    def _change_capsule(self, time_shift_minutes=settings.JOURNAL_NOTIFICATION_GRACE_PERIOD_MINUTES):
+    def _change_capsule(self, time_shift_minutes=settings.JOURNAL_NOTIFICATION_GRACE_PERIOD_MINUTES, email=None):
         with freeze_time(now() - timedelta(minutes=time_shift_minutes)):
-            self.create_capsule_recipient()
+            self.create_capsule_recipient(email)
 
     def _call_command(self):
         mail.outbox.clear()
         management.call_command("sendjournalnotifications")
+
+    def test_command_sends_notification_after_further_changes(self):
+        self._change_capsule()
+        self._call_command()
+        self._change_capsule(email="another-recipient@example.org")
+        self._call_command()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_command_advances_latest_notified_journal_entry(self):
+        self._change_capsule()
+        self._call_command()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.latest_notified_journal_entry, self.user.journal_entries.latest("id"))
+
+    def test_command_keeps_failed_notification_for_next_run(self):
+        self._change_capsule()
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("unavailable")):
+            self._call_command()
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.latest_notified_journal_entry)
+        self._call_command()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_command_queries_only_users_with_new_entries(self):
+        self._change_capsule()
+        self._call_command()
+        for _ in range(3):
+            self.create_user()
+        # no users with new entries: only the grouped journal entry query is issued
+        with self.assertNumQueries(1):
+            self._call_command()
+        self.assertEqual(len(mail.outbox), 0)
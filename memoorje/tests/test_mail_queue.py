@@ -0,0 +1,87 @@
+from smtplib import SMTPException
+from unittest import mock
+
+from django.conf import settings
+from django.core import mail, management
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import override_settings, TestCase
+from django.utils.timezone import now
+
+from memoorje.models import QueuedEmail
+from memoorje.tests.mixins import CapsuleRecipientMixin
+
+
+@override_settings(EMAIL_QUEUE_ENABLED=True)
+class MailQueueTestCase(CapsuleRecipientMixin, TestCase):
+    def test_emails_are_queued(self):
+        self.create_capsule_recipient()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedEmail.objects.count(), 1)
+
+    def test_flush_sends_and_removes_queued_emails(self):
+        for i in range(3):
+            self.create_capsule_recipient(f"recipient{i}@example.org")
+        management.call_command("flushmailqueue", batch_size=2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn(self.capsule.name, mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertCountEqual([m.to[0] for m in mail.outbox], [f"recipient{i}@example.org" for i in range(3)])
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_failed_emails_are_retried_later(self):
+        self.create_capsule_recipient()
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("unavailable")):
+            management.call_command("flushmailqueue")
+        email = QueuedEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "unavailable")
+        # the next attempt is not due yet
+        management.call_command("flushmailqueue")
+        self.assertEqual(len(mail.outbox), 0)
+        QueuedEmail.objects.update(next_attempt_on=email.created_on)
+        management.call_command("flushmailqueue")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_emails_are_given_up_after_max_attempts(self):
+        self.create_capsule_recipient()
+        QueuedEmail.objects.update(attempts=settings.EMAIL_QUEUE_MAX_ATTEMPTS - 1)
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("unavailable")):
+            with self.assertLogs("memoorje.management.commands.flushmailqueue", "ERROR"):
+                management.call_command("flushmailqueue")
+        # the content of given up emails is not kept
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_given_up_emails_are_deleted(self):
+        self.create_capsule_recipient()
+        QueuedEmail.objects.update(attempts=settings.EMAIL_QUEUE_MAX_ATTEMPTS)
+        management.call_command("flushmailqueue")
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_no_connection_without_due_emails(self):
+        with mock.patch.object(EmailBackend, "open") as open_connection:
+            management.call_command("flushmailqueue")
+        self.assertEqual(open_connection.call_count, 0)
+
+    def test_emails_are_leased_while_sending(self):
+        self.create_capsule_recipient()
+
+        def check_lease(messages):
+            # another run doesn't take the email being sent
+            self.assertFalse(QueuedEmail.objects.due(now()).exists())
+            self.assertTrue(QueuedEmail.objects.exists())
+
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=check_lease):
+            management.call_command("flushmailqueue")
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_connection_is_reopened_after_error(self):
+        for i in range(2):
+            self.create_capsule_recipient(f"recipient{i}@example.org")
+        with mock.patch.object(EmailBackend, "open") as open_connection:
+            with mock.patch.object(EmailBackend, "send_messages", side_effect=[SMTPException("unavailable"), 1]):
+                management.call_command("flushmailqueue")
+        # once for the command and once after the error
+        self.assertEqual(open_connection.call_count, 2)
+        self.assertEqual(QueuedEmail.objects.get().attempts, 1)
@@ -0,0 +1,100 @@
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from memoorje.tests.mixins import CapsuleContentMixin, CapsuleRecipientMixin, KeyslotMixin
+
+
+class RecipientTokenTestCase(CapsuleRecipientMixin, KeyslotMixin, TestCase):
+    url = "/api/keyslots/"
+
+    def setUp(self):
+        # tokens are only cached in a cache shared by all processes
+        cache_dir = TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        shared_cache = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": cache_dir.name,
+                }
+            }
+        )
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        self.create_capsule_recipient()
+        self.create_keyslot(recipient=self.capsule_recipient)
+        self.headers = self.get_request_headers(with_recipient_token_for=self.capsule_recipient)
+
+    def test_token_is_resolved_once(self):
+        """
+        The recipient is looked up once per request and skipped for repeated requests with the same token.
+        """
+        with CaptureQueriesContext(connection) as first_request:
+            response = self.client.get(self.url, **self.headers)
+        self.assertEqual(len(response.data), 1)
+        # recipient (with capsule) and keyslots
+        self.assertEqual(len(first_request), 2)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, **self.headers)
+        self.assertEqual(len(response.data), 1)
+
+    def test_token_of_changed_capsule(self):
+        """
+        A cached token is invalid after the capsule was changed.
+        """
+        self.client.get(self.url, **self.headers)
+        self.capsule.save()
+        response = self.client.get(self.url, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 0)
+
+    def test_token_of_deleted_recipient(self):
+        """
+        A cached token is invalid after the recipient was deleted.
+        """
+        self.client.get(self.url, **self.headers)
+        self.capsule_recipient.delete()
+        response = self.client.get(self.url, **self.headers)
+        self.assertEqual(len(response.data), 0)
+
+    def test_invalid_token(self):
+        """
+        Tokens not starting with a recipient id are rejected without a lookup.
+        """
+        # nothing is visible, so not even the keyslots are queried
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_X_MEMOORJE_RECIPIENT_TOKEN="invalid")
+        self.assertEqual(len(response.data), 0)
+
+
+class LocalRecipientTokenTestCase(CapsuleContentMixin, CapsuleRecipientMixin, TestCase):
+    def setUp(self):
+        self.create_capsule_content()
+        self.headers = self.get_request_headers_with_recipient_token()
+
+    def test_token_is_not_cached_in_local_memory(self):
+        """
+        With a cache per process, tokens are checked for each request, as other processes cannot drop them.
+        """
+        self.client.get("/api/capsule-contents/", **self.headers)
+        # recipient (with capsule) and capsule contents
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/capsule-contents/", **self.headers)
+        self.assertEqual(len(response.data), 1)
+
+    def test_deleted_recipient_with_stale_token(self):
+        """
+        A token resolved before its recipient was deleted (e.g. by another process) gives no access.
+        """
+        recipient = self.capsule_recipient
+        with mock.patch("memoorje.utils.get_recipient_by_token_cached", return_value=recipient):
+            self.capsule_recipient.delete()
+            response = self.client.get("/api/capsule-contents/", **self.headers)
+            self.assertEqual(len(response.data), 0)
+            response = self.client.get(self.capsule_content.data.url, **self.headers)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -1,13 +1,20 @@
+from concurrent.futures.process import BrokenProcessPool
 from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
 
 from django.conf import settings
 from django.core import mail, management
-from django.test import TestCase
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from django.test import override_settings, TestCase
 from django.utils.timezone import now
 from freezegun import freeze_time
 
-from memoorje.crypto import _encrypt_secret
+from memoorje.crypto import _encrypt_secret, PendingKeyslots
 from memoorje.models import Capsule, Keyslot
+from memoorje.secret_sharing import CombineWorkerPool
 from memoorje.tests.mixins import CapsuleRecipientMixin, KeyslotMixin, PartialKeyMixin
 
 
@@ -28,6 +35,19 @@ class ReleaseTestCase(CapsuleRecipientMixin, KeyslotMixin, PartialKeyMixin, Test
         management.call_command("releasecapsules")
         self.assertEqual(len(mail.outbox), 0)
 
+    def test_release_is_kept_if_notification_fails(self):
+        """
+        A refused release notification doesn't roll back the release, as the passwords might already have been sent to
+        other recipients.
+        """
+        self._create_release_setup()
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("refused")):
+            with self.assertLogs("memoorje.management.commands.releasecapsules", "ERROR"):
+                management.call_command("releasecapsules")
+        self.capsule.refresh_from_db()
+        self.assertTrue(self.capsule.is_released)
+        self.assertEqual(self.capsule.partial_keys.count(), 0)
+
     def test_release_capsules_skips_errors(self):
         self._create_release_setup()
         self.capsule.partial_keys.last().delete()
@@ -54,6 +74,66 @@ class ReleaseTestCase(CapsuleRecipientMixin, KeyslotMixin, PartialKeyMixin, Test
         capsule.refresh_from_db()
         self.assertTrue(capsule.is_released)
 
+    def test_release_capsules_with_workers(self):
+        """Keyslots of several capsules may be encrypted by worker processes."""
+        self._create_release_setup()
+        capsule = self.capsule
+        self.create_user()
+        self._create_release_setup()
+        mail.outbox.clear()
+        management.call_command("releasecapsules", workers=2, batch_size=1)
+        self.assertEqual(len(mail.outbox), 2)
+        for c in [capsule, self.capsule]:
+            c.refresh_from_db()
+            self.assertTrue(c.is_released)
+            self.assertEqual(c.keyslots.filter(purpose=Keyslot.Purpose.PASSWORD).count(), 1)
+
+    @override_settings(SECRET_SHARE_COMBINE_BACKEND="memoorje.crypto.combine_shares_with_worker_pool")
+    def test_release_capsules_with_combine_worker_pool(self):
+        """The partial keys of a batch of capsules are combined by the worker pool at once."""
+        self._create_release_setup()
+        capsule = self.capsule
+        self.create_user()
+        self._create_release_setup()
+        # the partial keys of this capsule cannot be combined
+        self.capsule.partial_keys.last().delete()
+        with mock.patch.object(CombineWorkerPool, "map", autospec=True, side_effect=CombineWorkerPool.map) as pool_map:
+            management.call_command("releasecapsules")
+        self.assertEqual(pool_map.call_count, 1)
+        capsule.refresh_from_db()
+        self.assertTrue(capsule.is_released)
+        self.capsule.refresh_from_db()
+        self.assertFalse(self.capsule.is_released)
+
+    def test_failed_keyslot_encryption_skips_capsule(self):
+        """If the keyslot encryption for a capsule fails, the other capsules are released anyway."""
+        self._create_release_setup()
+        self.create_user()
+        self._create_release_setup()
+        create = PendingKeyslots.create
+
+        def fail_once(pending_keyslots):
+            if pending_keyslots.capsule == self.capsule:
+                raise BrokenProcessPool()
+            return create(pending_keyslots)
+
+        with mock.patch.object(PendingKeyslots, "create", autospec=True, side_effect=fail_once):
+            with self.assertLogs("memoorje.management.commands.releasecapsules", "ERROR"):
+                management.call_command("releasecapsules", batch_size=1)
+        self.assertEqual(Capsule.objects.filter(is_released=True).count(), 1)
+        self.capsule.refresh_from_db()
+        self.assertFalse(self.capsule.is_released)
+        self.assertEqual(self.capsule.partial_keys.count(), 2)
+
+    def test_failed_release_leaves_no_keyslots(self):
+        """If marking the capsule as released fails, no recipient keyslots are stored."""
+        self._create_release_setup()
+        with mock.patch.object(QuerySet, "update", side_effect=DatabaseError):
+            self.assertRaises(DatabaseError, self.capsule.release)
+        self.capsule.refresh_from_db()
+        self.assertFalse(self.capsule.is_released)
+        self.assertFalse(self.capsule.keyslots.filter(purpose=Keyslot.Purpose.PASSWORD).exists())
+
     def test_release_capsule_immediately(self):
         """Capsules should be released after a grace period is elapsed.
 
@@ -64,6 +144,23 @@ class ReleaseTestCase(CapsuleRecipientMixin, KeyslotMixin, PartialKeyMixin, Test
         self.capsule.refresh_from_db()
         self.assertFalse(self.capsule.is_released)
 
+    def test_capsules_due_for_release_are_fetched_with_constant_queries(self):
+        due_capsules = []
+        for _ in range(2):
+            self.create_user()
+            self._create_release_setup()
+            due_capsules.append(self.capsule)
+        self.create_user()
+        self._create_release_setup(0)
+        with self.assertNumQueries(4):
+            capsules = list(Capsule.objects.due_for_release(now()))
+            for capsule in capsules:
+                self.assertEqual(len(capsule.partial_keys.all()), 2)
+                self.assertEqual(len(capsule.recipients.all()), 1)
+                self.assertEqual(len(capsule.keyslots.all()), 1)
+                self.assertIsNotNone(capsule.owner.language)
+        self.assertCountEqual(capsules, due_capsules)
+
     def _create_release_setup(self, time_shift_days=settings.CAPSULE_RELEASE_GRACE_PERIOD_DAYS):
         with freeze_time(now() - timedelta(days=time_shift_days)):
             self.create_capsule_recipient()
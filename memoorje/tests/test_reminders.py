@@ -1,19 +1,36 @@
 from datetime import date
+from smtplib import SMTPException
+from unittest import mock
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.core import mail, management
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
+from memoorje.models import User
 from memoorje.tests.mixins import CapsuleMixin
 
 
 class ReminderTestCase(CapsuleMixin, TestCase):
+    def create_capsule_for_new_user(self):
+        self.create_user()
+        self.create_capsule()
+
     def test_user_without_capsule(self):
         self.create_user()
         management.call_command("sendreminders")
         self.assertEqual(len(mail.outbox), 0)
 
+    def test_user_without_capsule_with_old_reminder(self):
+        self.create_user()
+        self.user.last_reminder_sent_on = date.today() - relativedelta(years=2)
+        self.user.save()
+        management.call_command("sendreminders")
+        self.assertEqual(len(mail.outbox), 0)
+
     def test_user_with_capsule(self):
         self.create_capsule()
         management.call_command("sendreminders")
@@ -38,9 +55,54 @@ class ReminderTestCase(CapsuleMixin, TestCase):
         self.user.refresh_from_db()
         self.assertNotEqual(self.user.last_reminder_sent_on, old_reminder_date)
 
+    def test_failed_reminder_is_not_recorded(self):
+        self.create_capsule()
+        self.capsule.created_on -= relativedelta(months=settings.DEFAULT_REMIND_INTERVAL_MONTHS + 1)
+        self.capsule.save()
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("unavailable")):
+            management.call_command("sendreminders")
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_reminder_sent_on)
+        # the reminder is sent on the next run
+        management.call_command("sendreminders")
+        self.assertEqual(len(mail.outbox), 1)
+
     def test_user_with_reminder_just_sent(self):
         self.create_capsule()
         self.user.last_reminder_sent_on = date.today()
         self.user.save()
         management.call_command("sendreminders")
         self.assertEqual(len(mail.outbox), 0)
+
+    def test_reminder_at_end_of_month(self):
+        self.create_capsule()
+        self.user.remind_interval = 6
+        self.user.last_reminder_sent_on = date(2021, 8, 31)
+        self.user.save()
+        self.assertFalse(User.objects.due_for_reminder(date(2022, 2, 27)).exists())
+        self.assertTrue(User.objects.due_for_reminder(date(2022, 2, 28)).exists())
+
+    def test_users_with_different_intervals(self):
+        self.create_capsule()
+        self.user.remind_interval = 1
+        self.user.last_reminder_sent_on = date.today() - relativedelta(months=2)
+        self.user.save()
+        user = self.user
+        self.create_capsule_for_new_user()
+        self.user.remind_interval = 3
+        self.user.last_reminder_sent_on = date.today() - relativedelta(months=2)
+        self.user.save()
+        self.assertEqual(list(User.objects.due_for_reminder(date.today())), [user])
+
+    def test_constant_queries(self):
+        def send_reminders(user_count):
+            for _ in range(user_count):
+                self.create_capsule_for_new_user()
+                self.user.last_reminder_sent_on = date.today() - relativedelta(months=self.user.remind_interval)
+                self.user.save()
+            with CaptureQueriesContext(connection) as queries:
+                management.call_command("sendreminders", batch_size=10)
+            return len(queries)
+
+        self.assertEqual(send_reminders(2), send_reminders(5))
+        self.assertEqual(len(mail.outbox), 7)
@@ -1,9 +1,21 @@
-from typing import Optional
+import hashlib
+import hmac
+from typing import Iterable, Optional
 
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.request import Request
 
 from memoorje.models import CapsuleRecipient
 
+RECIPIENT_TOKEN_CACHE_KEY = "capsule-recipient-token:{pk}"
+
+# cache backends which keep their entries per process
+PROCESS_LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+}
+
 
 def get_authenticated_user(request):
     if request is not None and request.user.is_authenticated:
@@ -12,8 +24,55 @@ def get_authenticated_user(request):
 
 
 def get_recipient_by_token(request: Request) -> Optional[CapsuleRecipient]:
-    token = request.headers.get("X-Memoorje-Recipient-Token")
+    """
+    The capsule recipient for the token in the X-Memoorje-Recipient-Token header. It is resolved only once per request.
+    """
+    # a DRF request wraps the Django request, which is shared by everything handling the request
+    http_request = getattr(request, "_request", request)
+    if not hasattr(http_request, "_cached_capsule_recipient"):
+        token = request.headers.get("X-Memoorje-Recipient-Token")
+        http_request._cached_capsule_recipient = get_recipient_by_token_cached(token)
+    return http_request._cached_capsule_recipient
+
+
+def get_recipient_by_token_cached(token: Optional[str]) -> Optional[CapsuleRecipient]:
+    """
+    Cached CapsuleRecipient.objects.get_by_token(). A checked token is remembered for a short while (see
+    RECIPIENT_TOKEN_CACHE_SECONDS), so repeated requests of a recipient skip the lookup and the token check. Tokens are
+    only cached in a cache shared by all processes, as otherwise invalidated tokens would be kept by other processes.
+    """
+    if token is None:
+        return None
+    pk, *_ = token.partition("-")
+    if not pk.isdigit():
+        return None
+    if not settings.RECIPIENT_TOKEN_CACHE_SECONDS or not is_cache_shared():
+        return _get_recipient_by_token(token)
+    cache_key = RECIPIENT_TOKEN_CACHE_KEY.format(pk=int(pk))
+    token_digest = hashlib.sha256(token.encode()).digest()
+    cached = cache.get(cache_key)
+    if cached is not None and hmac.compare_digest(cached[0], token_digest):
+        return cached[1]
+    recipient = _get_recipient_by_token(token)
+    if recipient is not None:
+        cache.set(cache_key, (token_digest, recipient), settings.RECIPIENT_TOKEN_CACHE_SECONDS)
+    return recipient
+
+
+def _get_recipient_by_token(token: str) -> Optional[CapsuleRecipient]:
     try:
         return CapsuleRecipient.objects.get_by_token(token)
     except CapsuleRecipient.DoesNotExist:
         return None
+
+
+def forget_recipient_tokens(recipient_pks: Iterable[int]):
+    """Drop the cached tokens of the given recipients, e.g. because they became invalid."""
+    # the recipients are only queried if tokens are cached at all
+    if is_cache_shared():
+        cache.delete_many([RECIPIENT_TOKEN_CACHE_KEY.format(pk=pk) for pk in recipient_pks])
+
+
+def is_cache_shared() -> bool:
+    """Whether the default cache is shared by all processes (e.g. a database or memcached cache)."""
+    return settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHE_BACKENDS